@@ -0,0 +1,262 @@
+"""Time imports through pepperbox's openat finders against the
+standard FileFinder.
+
+    python benchmarks/bench_imports.py -o results.json
+    python benchmarks/bench_imports.py --strace --modules requests
+
+Each measurement runs in a fresh interpreter.  A cold import is the
+first import of the modules in that interpreter, with every finder
+cache empty (the OS page cache is left alone); a warm import repeats
+it after the imported modules are removed from sys.modules.  The
+openat finders are installed without capability rights or
+capability mode, so only the finders' own cost is measured.
+
+pepperbox must be importable, e.g. installed with pip install -e.
+
+Reported per tree, finder and phase: wall time (min and median over
+--repeat runs), peak RSS, read system calls from /proc/self/io where
+it exists, and, with --strace, a count of every system call made
+during the phase.
+"""
+import argparse
+import importlib
+import json
+import os
+import platform
+import re
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import treegen
+
+
+_clock = getattr(time, 'perf_counter', time.time)
+
+STDLIB_MODULES = ['argparse', 'json', 'logging.handlers', 'email.mime.text',
+                  'http.client', 'xml.dom.minidom', 'unittest', 'decimal',
+                  'asyncio', 'pydoc']
+
+FIND_EXTENSIONS = '''
+import importlib, json, sys
+from importlib.machinery import EXTENSION_SUFFIXES
+sys.path[:0] = {path!r}
+for module in {modules!r}:
+    importlib.import_module(module)
+json.dump(sorted(name for name, module in list(sys.modules.items())
+                 if getattr(module, '__file__', None) and
+                 module.__file__.endswith(tuple(EXTENSION_SUFFIXES))),
+          sys.stdout)
+'''
+
+# % time, seconds, usecs/call, calls, errors (if any), syscall
+_STRACE_ROW = re.compile(r'^\s*[\d.]+\s+[\d.]+\s+\d+\s+(\d+)\s+'
+                         r'(?:\d+\s+)?(\w+)$')
+
+
+def _proc_io():
+    try:
+        with open('/proc/self/io') as f:
+            return dict((key, int(value)) for key, value in
+                        (line.split(':') for line in f))
+    except (IOError, OSError):
+        return {}
+
+
+def _clear(before):
+    for name in set(sys.modules) - before:
+        del sys.modules[name]
+
+
+def child(args):
+    """Run in the measured interpreter: import the modules and print
+    a JSON result."""
+    sys.path[:0] = args.path
+    for preimport in args.preimports:
+        try:
+            __import__(preimport)
+        except ImportError:
+            pass
+    # both finders start from the same sys.modules, so that neither
+    # times modules pepperbox's import brought in for the other
+    from pepperbox.loader import install
+    if args.finder == 'openat':
+        install(rights=(), index=args.index, mode=args.mode)
+    else:
+        importlib.invalidate_caches()
+
+    before = set(sys.modules)
+    if args.phase == 'warm':
+        for module in args.modules:
+            importlib.import_module(module)
+        _clear(before)
+
+    io_before = _proc_io()
+    start = _clock()
+    if args.phase != 'baseline':
+        for module in args.modules:
+            importlib.import_module(module)
+    wall = _clock() - start
+    io_after = _proc_io()
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    result = {'wall': wall, 'maxrss': usage.ru_maxrss}
+    if io_before:
+        result['read_syscalls'] = io_after['syscr'] - io_before['syscr']
+    json.dump(result, sys.stdout)
+
+
+def parse_strace(path):
+    """Return a dict mapping system call names to counts from the
+    summary strace -c writes."""
+    counts = {}
+    with open(path) as f:
+        for line in f:
+            match = _STRACE_ROW.match(line)
+            if match and match.group(2) != 'total':
+                counts[match.group(2)] = int(match.group(1))
+    return counts
+
+
+def measure(finder, phase, modules, path, preimports, index, mode,
+            use_strace):
+    command = [sys.executable, os.path.abspath(__file__), '--child',
+               '--finder', finder, '--phase', phase,
+               '--modules'] + modules + ['--path'] + path + [
+               '--preimports'] + preimports
+    if index:
+        command.append('--index')
+    command.extend(['--mode', mode])
+    if not use_strace:
+        output = subprocess.check_output(command)
+        return json.loads(output.decode('utf-8'))
+
+    fd, strace_path = tempfile.mkstemp(suffix='.strace')
+    os.close(fd)
+    try:
+        output = subprocess.check_output(
+            ['strace', '-f', '-c', '-o', strace_path] + command)
+        result = json.loads(output.decode('utf-8'))
+        result['syscalls'] = parse_strace(strace_path)
+    finally:
+        os.unlink(strace_path)
+    return result
+
+
+def extension_modules(modules, path):
+    """Return the extension modules importing modules loads, other
+    than those among modules themselves.  Both finders import them
+    before the clock starts, so that only the extension modules asked
+    for are timed."""
+    output = subprocess.check_output(
+        [sys.executable, '-c',
+         FIND_EXTENSIONS.format(modules=modules, path=path)])
+    return [name for name in json.loads(output.decode('utf-8'))
+            if name not in modules]
+
+
+def _subtract(counts, baseline):
+    delta = dict((name, count - baseline.get(name, 0))
+                 for name, count in counts.items())
+    return dict((name, count) for name, count in delta.items() if count)
+
+
+def run(tree, modules, path, args):
+    use_strace = args.strace and _have_strace()
+    preimports = args.preimports + extension_modules(modules, path)
+    for finder in args.finders:
+        runs = {}
+        for phase in 'baseline', 'cold', 'warm':
+            runs[phase] = [measure(finder, phase, modules, path,
+                                   preimports, args.index, args.mode,
+                                   use_strace)
+                           for _ in range(args.repeat)]
+
+        for phase in 'cold', 'warm':
+            walls = sorted(r['wall'] for r in runs[phase])
+            result = {'tree': tree, 'finder': finder, 'phase': phase,
+                      'modules': len(modules),
+                      'wall_min': walls[0],
+                      'wall_median': walls[len(walls) // 2],
+                      'maxrss': max(r['maxrss'] for r in runs[phase])}
+            last = runs[phase][-1]
+            if 'read_syscalls' in last:
+                result['read_syscalls'] = last['read_syscalls']
+            if use_strace:
+                # strace counts the whole interpreter; the warm run
+                # imports everything twice
+                previous = 'baseline' if phase == 'cold' else 'cold'
+                result['syscalls'] = _subtract(
+                    last['syscalls'], runs[previous][-1]['syscalls'])
+                result['syscall_total'] = sum(result['syscalls'].values())
+            yield result
+
+
+def _have_strace():
+    which = getattr(shutil, 'which', None)
+    return which is not None and which('strace') is not None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-o', '--output', help='write JSON results here')
+    parser.add_argument('--finders', nargs='+', default=['stock', 'openat'],
+                        choices=['stock', 'openat'])
+    parser.add_argument('--modules', nargs='*',
+                        help='real modules to import instead of a '
+                        'selection of the standard library')
+    parser.add_argument('--no-synthetic', dest='synthetic',
+                        action='store_false',
+                        help="don't time a generated tree")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--index', action='store_true',
+                        help='install the indexed openat finder')
+    parser.add_argument('--mode', default='meta_path',
+                        choices=['meta_path', 'path_hooks'],
+                        help="install's mode for the openat finders")
+    parser.add_argument('--strace', action='store_true',
+                        help='count system calls with strace -f -c')
+    parser.add_argument('--preimports', nargs='*', default=[],
+                        help='modules both finders import before timing')
+
+    # the measured interpreter's arguments
+    parser.add_argument('--child', action='store_true',
+                        help=argparse.SUPPRESS)
+    parser.add_argument('--finder', help=argparse.SUPPRESS)
+    parser.add_argument('--phase', help=argparse.SUPPRESS)
+    parser.add_argument('--path', nargs='*', default=[],
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        return child(args)
+
+    results = []
+    real = args.modules or STDLIB_MODULES
+    results.extend(run('real', real, [], args))
+    if args.synthetic:
+        root = tempfile.mkdtemp(prefix='pepperbox-bench-')
+        try:
+            tree = treegen.generate(os.path.join(root, 'tree'), modules=500)
+            results.extend(run('synthetic', tree.modules, tree.path, args))
+        finally:
+            shutil.rmtree(root)
+
+    report = {'python': platform.python_version(),
+              'implementation': platform.python_implementation(),
+              'platform': platform.platform(),
+              'repeat': args.repeat,
+              'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
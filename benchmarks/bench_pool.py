@@ -0,0 +1,75 @@
+"""Compare the throughput of pepperbox.pool.Pool against starting a
+sandboxed interpreter per job.
+
+    python benchmarks/bench_pool.py --workers 1 2 4 8 --jobs 2000
+
+Prints one JSON object per configuration.
+"""
+import argparse
+import json
+import multiprocessing
+import subprocess
+import sys
+import time
+
+from pepperbox.pool import Pool
+from pepperbox.zygote import Zygote
+
+
+SPAWN_JOB = '''
+from pepperbox.restrict import restrict
+restrict()
+print({} * 2)
+'''
+
+
+def job(x):
+    return x * 2
+
+
+def bench_pool(zygote, workers, jobs, batch_size):
+    with Pool(workers, zygote, batch_size=batch_size) as pool:
+        # the workers are alive before the clock starts
+        start = time.time()
+        for result in pool.imap(job, range(jobs)):
+            assert result.ok, result.value
+        return time.time() - start
+
+
+def bench_spawn(jobs):
+    start = time.time()
+    for x in range(jobs):
+        subprocess.check_output([sys.executable, '-c', SPAWN_JOB.format(x)])
+    return time.time() - start
+
+
+def report(mode, jobs, elapsed, **details):
+    details.update(mode=mode, jobs=jobs, seconds=elapsed,
+                   jobs_per_second=jobs / elapsed)
+    print(json.dumps(details, sort_keys=True))
+    sys.stdout.flush()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, nargs='+',
+                        default=[multiprocessing.cpu_count()])
+    parser.add_argument('--jobs', type=int, default=1000)
+    parser.add_argument('--batch-size', type=int, nargs='+', default=[1, 16])
+    parser.add_argument('--spawn-jobs', type=int, default=50,
+                        help='jobs to time for spawn-per-job; 0 skips it')
+    args = parser.parse_args(argv)
+
+    if args.spawn_jobs:
+        report('spawn', args.spawn_jobs, bench_spawn(args.spawn_jobs))
+
+    zygote = Zygote()
+    for workers in args.workers:
+        for batch_size in args.batch_size:
+            elapsed = bench_pool(zygote, workers, args.jobs, batch_size)
+            report('pool', args.jobs, elapsed, workers=workers,
+                   batch_size=batch_size)
+
+
+if __name__ == '__main__':
+    main()
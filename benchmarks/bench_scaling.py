@@ -0,0 +1,105 @@
+"""Show how import cost grows with each dimension of a module tree.
+
+    python benchmarks/bench_scaling.py --repeat 3 -o scaling.json
+
+Starting from a base tree, one dimension at a time is swept -- the
+number of modules, package depth, sys.path entries, namespace
+package portions, the fraction of sourceless bytecode and the number
+of extension modules -- and every module in each tree is imported
+cold and warm through the stock and openat finders, as
+bench_imports.py does.  A final point combines many path entries with
+many modules.
+
+The openat finders on sys.meta_path see only the first portion of a
+namespace package, so unless --mode says otherwise the namespace
+points install them as path hooks.  A point whose measurement fails
+is recorded with its error, and the sweep goes on.
+"""
+import argparse
+import json
+import shutil
+import subprocess
+import sys
+import tempfile
+
+import bench_imports
+import treegen
+
+
+BASE = dict(modules=1000, depth=1, path_entries=1, namespace_portions=0,
+            pyc_fraction=0.0, extensions=0)
+
+SWEEPS = [('modules', [100, 1000, 5000]),
+          ('depth', [1, 4, 8]),
+          ('path_entries', [1, 10, 30]),
+          ('namespace_portions', [0, 10, 30]),
+          ('pyc_fraction', [0.0, 0.5, 1.0]),
+          ('extensions', [0, 10, 50])]
+
+COMBINED = dict(BASE, modules=5000, path_entries=30)
+
+
+def points(sweeps):
+    for dimension, values in sweeps:
+        for value in values:
+            yield dimension, value, dict(BASE, **{dimension: value})
+    yield 'combined', None, COMBINED
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-o', '--output', help='write JSON results here')
+    parser.add_argument('--dimensions', nargs='+',
+                        choices=[dimension for dimension, _ in SWEEPS],
+                        help='sweep only these dimensions')
+    parser.add_argument('--finders', nargs='+', default=['stock', 'openat'],
+                        choices=['stock', 'openat'])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--index', action='store_true',
+                        help='install the indexed openat finder')
+    parser.add_argument('--mode', choices=['meta_path', 'path_hooks'],
+                        help="install's mode for the openat finders; by "
+                        'default path_hooks for namespace packages and '
+                        'meta_path otherwise')
+    parser.add_argument('--strace', action='store_true',
+                        help='count system calls with strace -f -c')
+    args = parser.parse_args(argv)
+    args.preimports = []
+
+    sweeps = [(dimension, values) for dimension, values in SWEEPS
+              if not args.dimensions or dimension in args.dimensions]
+    results = []
+    for dimension, value, kwargs in points(sweeps):
+        point_args = argparse.Namespace(**vars(args))
+        if args.mode is None:
+            point_args.mode = ('path_hooks' if kwargs['namespace_portions']
+                               else 'meta_path')
+        root = tempfile.mkdtemp(prefix='pepperbox-scaling-')
+        try:
+            tree = treegen.generate(root + '/tree', **kwargs)
+            names = tree.modules + tree.extensions
+            point = dict(dimension=dimension, value=value, params=kwargs,
+                         mode=point_args.mode)
+            try:
+                for result in bench_imports.run(dimension, names, tree.path,
+                                                point_args):
+                    result.update(point,
+                                  per_module=result['wall_min'] / len(names))
+                    results.append(result)
+                    print(json.dumps(result, sort_keys=True))
+                    sys.stdout.flush()
+            except subprocess.CalledProcessError as e:
+                result = dict(point, error=str(e))
+                results.append(result)
+                print(json.dumps(result, sort_keys=True))
+                sys.stdout.flush()
+        finally:
+            shutil.rmtree(root)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+"""Generate synthetic module trees for scaling benchmarks.
+
+    python benchmarks/treegen.py /tmp/tree --modules 5000 --path-entries 30
+
+writes the tree and prints a JSON description of it: the sys.path
+entries to use and the names of the importable modules.
+"""
+import argparse
+import json
+import os
+import py_compile
+import random
+import shutil
+import sys
+
+
+class Tree(object):
+    """A generated tree.
+
+    :param path: the directories to put on sys.path, in order.
+
+    :param modules: the names of the pure Python modules, packages
+    and namespace package portions that can be imported.
+
+    :param extensions: the names of the extension modules, which are
+    copies of an existing one, each in a package of its own.
+    """
+
+    def __init__(self, root, path, modules, extensions):
+        self.root = root
+        self.path = path
+        self.modules = modules
+        self.extensions = extensions
+
+    def as_dict(self):
+        return {'root': self.root, 'path': self.path,
+                'modules': self.modules, 'extensions': self.extensions}
+
+
+def _write_module(path, name, sourceless):
+    source = path + '.py'
+    with open(source, 'w') as f:
+        f.write('NAME = {!r}\n'.format(name))
+    if sourceless:
+        # a .pyc beside where its source was is loaded without it
+        py_compile.compile(source, cfile=path + '.pyc', doraise=True)
+        os.unlink(source)
+
+
+def _donor_extension():
+    """Return the path and module name of an extension module
+    shared library to copy."""
+    try:
+        from importlib.machinery import EXTENSION_SUFFIXES
+    except ImportError:
+        import imp
+        EXTENSION_SUFFIXES = [suffix
+                              for suffix, _, kind in imp.get_suffixes()
+                              if kind == imp.C_EXTENSION]
+    for name in '_json', 'array', 'math', 'select':
+        module = __import__(name)
+        filename = getattr(module, '__file__', None)
+        if filename and filename.endswith(tuple(EXTENSION_SUFFIXES)):
+            return filename, name
+    raise RuntimeError('no extension module to copy')
+
+
+def _package(path):
+    os.makedirs(path)
+    open(os.path.join(path, '__init__.py'), 'w').close()
+
+
+def generate(root, modules=1000, depth=1, path_entries=1,
+             namespace_portions=0, pyc_fraction=0.0, extensions=0,
+             seed=0):
+    """Write a tree beneath root, which must not exist, and return a
+    Tree describing it.
+
+    :param modules: the number of modules, spread across the sys.path
+    entries.  Every module's name is unique, so each is found in only
+    one entry.
+
+    :param depth: how deeply packages nest.  Each entry's modules live
+    in the innermost of a chain of depth packages; 0 makes them top
+    level modules.
+
+    :param path_entries: the number of sys.path directories.
+
+    :param namespace_portions: the number of portions of the
+    namespace package bench_ns, one per entry from the last back,
+    wrapping around.  A second entry is added if there's only one, so
+    that the portions are always spread across more than one.
+
+    :param pyc_fraction: the fraction of modules that are bytecode
+    without source.
+
+    :param extensions: the number of packages, from the first, that
+    hold a copy of an extension module.
+    """
+    rng = random.Random(seed)
+    path = []
+    names = []
+    extension_names = []
+    os.makedirs(root)
+
+    for i in range(path_entries):
+        entry = os.path.join(root, 'entry{}'.format(i))
+        os.mkdir(entry)
+        path.append(entry)
+
+    packages = []
+    for i, entry in enumerate(path):
+        parts = ['t{}_p{}'.format(i, level) for level in range(depth)]
+        if parts:
+            for level in range(1, depth + 1):
+                _package(os.path.join(entry, *parts[:level]))
+                names.append('.'.join(parts[:level]))
+        packages.append((entry, parts))
+
+    for j in range(modules):
+        entry, parts = packages[j % path_entries]
+        name = 'm{}'.format(j)
+        if not parts:
+            name = 't{}_{}'.format(j % path_entries, name)
+        _write_module(os.path.join(entry, *(parts + [name])),
+                      '.'.join(parts + [name]),
+                      rng.random() < pyc_fraction)
+        names.append('.'.join(parts + [name]))
+
+    if namespace_portions and len(path) < 2:
+        entry = os.path.join(root, 'entry{}'.format(len(path)))
+        os.mkdir(entry)
+        path.append(entry)
+    for k in range(namespace_portions):
+        entry = path[-1 - k % len(path)]
+        portion = os.path.join(entry, 'bench_ns')
+        if not os.path.isdir(portion):
+            os.mkdir(portion)
+        name = 'portion{}'.format(k)
+        _write_module(os.path.join(portion, name), 'bench_ns.' + name,
+                      False)
+        names.append('bench_ns.' + name)
+
+    if extensions:
+        donor, donor_name = _donor_extension()
+        suffix = os.path.basename(donor)[len(donor_name):]
+        for k in range(extensions):
+            entry, parts = packages[k % path_entries]
+            if not parts:
+                raise ValueError('extension modules need depth > 0')
+            # a package can hold only one copy
+            package = parts + ['ext{}'.format(k)]
+            _package(os.path.join(entry, *package))
+            shutil.copy(donor, os.path.join(entry, *package + [
+                donor_name + suffix]))
+            names.append('.'.join(package))
+            extension_names.append('.'.join(package + [donor_name]))
+
+    return Tree(root, path, names, extension_names)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('root', help='the directory to create')
+    parser.add_argument('--modules', type=int, default=1000)
+    parser.add_argument('--depth', type=int, default=1)
+    parser.add_argument('--path-entries', type=int, default=1)
+    parser.add_argument('--namespace-portions', type=int, default=0)
+    parser.add_argument('--pyc-fraction', type=float, default=0.0)
+    parser.add_argument('--extensions', type=int, default=0)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+    tree = generate(args.root, args.modules, args.depth, args.path_entries,
+                    args.namespace_portions, args.pyc_fraction,
+                    args.extensions, args.seed)
+    json.dump(tree.as_dict(), sys.stdout, indent=2)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
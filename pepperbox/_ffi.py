@@ -1,51 +1,61 @@
-import cffi
-
-
-ffi = cffi.FFI()
-
-ffi.cdef('''
-static const int RTLD_NOW;
-static const int RTLD_LAZY;
-
-void *
-fdlopen(int fd, int mode);
-
-void *
-dlsym(void * restrict handle, const char * restrict symbol);
-
-char *
-dlerror(void);
-
-uintptr_t
-addrof(void * f);
-
-''')
-
-
-lib = ffi.verify('''
-#include <dlfcn.h>
-
-
-uintptr_t
-addrof(void * p)
-{
-    return (uintptr_t)p;
-}
-''',
-                 ext_package='pepperbox')
-
-RTLD_NOW = lib.RTLD_NOW
+"""fdlopen and dlsym, through pepperbox._pepperbox_ffi, which
+setup.py compiles from _ffi_build.py.
+
+Importing this module doesn't import the compiled one, but every
+process that calls pepperbox.loader.install does: install calls load
+before creating any finder, so _pepperbox_ffi and cffi's backend,
+_cffi_backend, are imported whether or not an extension module is
+ever loaded.
+"""
+import os
+
+
+# os.RTLD_NOW is new in Python 3.3; its value is 2 on both FreeBSD
+# and Linux
+RTLD_NOW = getattr(os, 'RTLD_NOW', 2)
+
+ffi = lib = None
+_error = None
+
+
+def load():
+    """Import the compiled module, and with it cffi's backend, if that
+    hasn't been tried yet.  Returns True if it's available.
+
+    The compiled module is itself an extension module, so it must be
+    imported before the openat finders are installed; otherwise
+    importing it would need fdlopen, which needs it.
+    pepperbox.loader.install calls this first.
+    """
+    global ffi, lib, _error
+    if lib is None and _error is None:
+        # a reentrant call, made while importing it, fails
+        _error = ImportError('pepperbox._pepperbox_ffi is being imported')
+        try:
+            from ._pepperbox_ffi import ffi, lib
+        except ImportError as e:
+            _error = e
+        else:
+            _error = None
+    return lib is not None
+
+
+def _lib():
+    if not load():
+        raise ImportError('cannot load extension modules: {}'.format(
+            _error))
+    return lib
 
 
 def fdlopen(fd, flags):
-    loaded_so = lib.fdlopen(fd, lib.RTLD_NOW)
+    loaded_so = _lib().fdlopen(fd, flags)
     if loaded_so == ffi.NULL:
         raise RuntimeError(ffi.string(lib.dlerror()))
     return loaded_so
 
 
 def dlsym(loaded_so, symname):
-    void_ptr = lib.dlsym(loaded_so, symname)
+    void_ptr = _lib().dlsym(loaded_so, symname)
     if void_ptr == ffi.NULL:
         raise RuntimeError(ffi.string(lib.dlerror()))
     return void_ptr
@@ -53,6 +63,6 @@ def dlsym(loaded_so, symname):
 
 def make_callable_with_gil(initmodulefunc):
     def callable_with_gil(void_ptr):
-        addr = lib.addrof(void_ptr)
+        addr = _lib().addrof(void_ptr)
         return initmodulefunc(addr)
     return callable_with_gil
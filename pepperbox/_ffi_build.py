@@ -0,0 +1,35 @@
+import cffi
+
+
+ffibuilder = cffi.FFI()
+
+ffibuilder.cdef('''
+void *
+fdlopen(int fd, int mode);
+
+void *
+dlsym(void * restrict handle, const char * restrict symbol);
+
+char *
+dlerror(void);
+
+uintptr_t
+addrof(void * f);
+
+''')
+
+
+ffibuilder.set_source('pepperbox._pepperbox_ffi', '''
+#include <dlfcn.h>
+
+
+uintptr_t
+addrof(void * p)
+{
+    return (uintptr_t)p;
+}
+''')
+
+
+if __name__ == '__main__':
+    ffibuilder.compile(verbose=True)
@@ -0,0 +1,298 @@
+import argparse
+import collections
+import fcntl
+import marshal
+import mmap
+import os
+import pkgutil
+import struct
+import tempfile
+
+from .support import PY_TAG
+
+
+IMAGE_MAGIC = b'PBXI'
+IMAGE_VERSION = 1
+
+# magic, version, interpreter tag, index length
+_HEADER = struct.Struct('!4sI32sQ')
+
+CODE = 1
+EXTENSION = 2
+
+ImageEntry = collections.namedtuple('ImageEntry',
+                                    'kind is_package offset length '
+                                    'source_offset source_length filename')
+
+
+# sealing is new in Python 3.8, and Linux only
+_F_ADD_SEALS = getattr(fcntl, 'F_ADD_SEALS', None)
+_SEALS = sum(getattr(fcntl, seal, 0)
+             for seal in ('F_SEAL_SEAL', 'F_SEAL_SHRINK', 'F_SEAL_GROW',
+                          'F_SEAL_WRITE'))
+
+
+class BadImage(Exception):
+    pass
+
+
+def _extension_suffixes():
+    try:
+        from importlib.machinery import EXTENSION_SUFFIXES
+    except ImportError:
+        import imp
+        return [suffix for suffix, _, kind in imp.get_suffixes()
+                if kind == imp.C_EXTENSION]
+    return EXTENSION_SUFFIXES
+
+
+def _walk(names, recursive):
+    for name in names:
+        yield name
+        loader = pkgutil.get_loader(name)
+        if recursive and loader is not None and loader.is_package(name):
+            package = __import__(name, fromlist=['__name__'])
+            for _, subname, _ in pkgutil.walk_packages(package.__path__,
+                                                       name + '.'):
+                yield subname
+
+
+def _entries(names, recursive, sources):
+    """Yield (fullname, kind, is_package, data, source, filename) for
+    each named module, resolved with the standard import machinery."""
+    extension_suffixes = tuple(_extension_suffixes())
+    seen = set()
+    for fullname in _walk(names, recursive):
+        if fullname in seen:
+            continue
+        seen.add(fullname)
+
+        loader = pkgutil.get_loader(fullname)
+        if loader is None:
+            raise ImportError('No module named {}'.format(fullname))
+        path = loader.get_filename(fullname)
+        is_package = loader.is_package(fullname)
+
+        parts = fullname.split('.')
+        if is_package:
+            parts.append(os.path.splitext(os.path.basename(path))[0])
+        is_extension = path.endswith(extension_suffixes)
+        if is_extension:
+            ext = next(suffix for suffix in extension_suffixes
+                       if path.endswith(suffix))
+        else:
+            _, ext = os.path.splitext(path)
+        filename = '/'.join(parts) + ext
+
+        if is_extension:
+            with open(path, 'rb') as f:
+                yield (fullname, EXTENSION, is_package, f.read(), None,
+                       filename)
+            continue
+
+        source = loader.get_source(fullname) if sources else None
+        if source is not None and not isinstance(source, bytes):
+            source = source.encode('utf-8')
+        yield (fullname, CODE, is_package,
+               marshal.dumps(loader.get_code(fullname)), source, filename)
+
+
+def build(fileobj, names, recursive=False, sources=True):
+    """Write an image of the named modules to fileobj.
+
+    An image is a header, a marshalled dict that maps each module's
+    full name to its ImageEntry, and then the modules' marshalled
+    code, source and extension module contents, one after another.
+    Entry offsets are relative to the end of the index.
+
+    :param names: the modules to include.  The packages containing
+    them must be included separately.
+
+    :param recursive: include every submodule of named packages.
+
+    :param sources: include source code for tracebacks and
+    get_source.
+    """
+    blobs = []
+    index = {}
+    offset = 0
+    for fullname, kind, is_package, data, source, filename in _entries(
+            names, recursive, sources):
+        source_offset = offset + len(data)
+        source = source or b''
+        index[fullname] = (kind, is_package, offset, len(data),
+                           source_offset, len(source), filename)
+        blobs.extend([data, source])
+        offset = source_offset + len(source)
+
+    marshalled = marshal.dumps(index)
+    fileobj.write(_HEADER.pack(IMAGE_MAGIC, IMAGE_VERSION,
+                               PY_TAG.encode('ascii'), len(marshalled)))
+    fileobj.write(marshalled)
+    for blob in blobs:
+        fileobj.write(blob)
+
+
+def _anonymous_file(name):
+    """Return a descriptor open on a new file that exists only in
+    memory, and whether it can be sealed.  Where memfd_create isn't
+    available, an unlinked temporary file is used instead."""
+    memfd_create = getattr(os, 'memfd_create', None)
+    if memfd_create is None:
+        fd, path = tempfile.mkstemp(prefix=name)
+        os.unlink(path)
+        return fd, False
+    fd = memfd_create(name, os.MFD_CLOEXEC | os.MFD_ALLOW_SEALING)
+    return fd, _F_ADD_SEALS is not None
+
+
+def _write_sealed(name, write):
+    fd, sealable = _anonymous_file(name)
+    try:
+        with os.fdopen(os.dup(fd), 'wb') as f:
+            write(f)
+        if sealable:
+            fcntl.fcntl(fd, _F_ADD_SEALS, _SEALS)
+        os.lseek(fd, 0, os.SEEK_SET)
+    except BaseException:
+        os.close(fd)
+        raise
+    return fd
+
+
+def build_memfd(names, recursive=False, sources=True,
+                name='pepperbox-image'):
+    """Write an image of the named modules, as build does, to an
+    anonymous file in memory and seal it against further changes.
+    Returns a descriptor open on it for install's image argument.
+
+    Workers forked from the process holding the descriptor, or sent
+    it, map the same pages, so the image's code is held in memory
+    once however many workers use it.
+
+    Where memfd_create isn't available, an unlinked temporary file is
+    used instead; it can't be sealed.
+
+    :param name: the name the file is given for debugging.
+    """
+    return _write_sealed(
+        name, lambda f: build(f, names, recursive, sources))
+
+
+class Image(object):
+    """A read only mapping of an image written by build.
+
+    :param fd: a descriptor open on the image.  It may be closed once
+    the Image has been created.
+
+    :param name: the path the image's modules appear beneath in
+    __file__ and __path__.
+    """
+
+    def __init__(self, fd, name):
+        self.name = name
+        self._map = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+        try:
+            # marshal and memoryview slices share the mapping's pages
+            self._view = memoryview(self._map)
+        except TypeError:
+            # ...but Python 2's mmap predates memoryview
+            self._view = self._map
+
+        if len(self._map) < _HEADER.size:
+            raise BadImage('{} is too short to be an image'.format(name))
+        magic, version, tag, index_length = _HEADER.unpack_from(self._map)
+        if (magic, version) != (IMAGE_MAGIC, IMAGE_VERSION):
+            raise BadImage('{} is not a version {} image'.format(
+                name, IMAGE_VERSION))
+        if tag.rstrip(b'\0') != PY_TAG.encode('ascii'):
+            raise BadImage('{} was built for {}'.format(name, tag))
+
+        start = _HEADER.size
+        self._index = marshal.loads(self._map[start:start + index_length])
+        self._base = start + index_length
+        self._extension_fds = {}
+
+    def __contains__(self, fullname):
+        return fullname in self._index
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def get(self, fullname):
+        entry = self._index.get(fullname)
+        return entry and ImageEntry(*entry)
+
+    def data(self, fullname):
+        entry = self.get(fullname)
+        start = self._base + entry.offset
+        return self._view[start:start + entry.length]
+
+    def code(self, fullname):
+        return marshal.loads(self.data(fullname))
+
+    def source(self, fullname):
+        entry = self.get(fullname)
+        if not entry.source_length:
+            return None
+        start = self._base + entry.source_offset
+        return bytes(self._view[start:start + entry.source_length])
+
+    def path(self, fullname):
+        return os.path.join(self.name, self.get(fullname).filename)
+
+    def open_extensions(self):
+        """Copy every extension module into an anonymous file in
+        memory now, rather than when extension_fd first asks for it.
+        Call this before restrict() limits resources: writing the
+        copies fails once RLIMIT_FSIZE is 0, as does creating the
+        temporary files used where memfd_create isn't available once
+        in capability mode."""
+        for fullname in self._index:
+            if self.get(fullname).kind == EXTENSION:
+                self.extension_fd(fullname)
+
+    def extension_fd(self, fullname):
+        """Return a descriptor that fdlopen can load the extension
+        module fullname from, copying it into an anonymous file in
+        memory the first time it's asked for."""
+        fd = self._extension_fds.get(fullname)
+        if fd is None:
+            data = self.data(fullname)
+            fd = self._extension_fds[fullname] = _write_sealed(
+                fullname, lambda f: f.write(data))
+        return fd
+
+
+def open_image(image):
+    """Map image, which is either a path or a descriptor open on an
+    image such as one from build_memfd.  A descriptor is left open,
+    and its modules appear beneath the name <image N>."""
+    if isinstance(image, int):
+        return Image(image, '<image {}>'.format(image))
+    with open(image, 'rb') as f:
+        return Image(f.fileno(), image)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m pepperbox.image',
+        description="Write an image for pepperbox.loader.install's "
+        'image argument.')
+    parser.add_argument('-o', '--output', required=True,
+                        help='the image file to write')
+    parser.add_argument('-r', '--recursive', action='store_true',
+                        help='include the submodules of named packages')
+    parser.add_argument('--no-sources', dest='sources',
+                        action='store_false',
+                        help='leave out source code')
+    parser.add_argument('modules', nargs='+',
+                        help='the modules to include')
+    args = parser.parse_args(argv)
+
+    with open(args.output, 'wb') as f:
+        build(f, args.modules, args.recursive, args.sources)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+import argparse
+import collections
+import sys
+
+from .support import PY_TAG
+
+
+class Recorder(object):
+    """A meta path finder that finds nothing, but notes the name of
+    every module it's asked for."""
+
+    def __init__(self):
+        self._requested = collections.OrderedDict()
+
+    @property
+    def recording(self):
+        return self in sys.meta_path
+
+    def start(self):
+        if not self.recording:
+            sys.meta_path.insert(0, self)
+
+    def stop(self):
+        if self.recording:
+            sys.meta_path.remove(self)
+
+    def find_spec(self, fullname, path=None, target=None):
+        self._requested[fullname] = None
+        return None
+
+    def find_module(self, fullname, path=None):
+        self._requested[fullname] = None
+        return None
+
+    def names(self):
+        """Return the names of the modules imported while recording,
+        in the order they were first requested, leaving out those
+        that failed to import."""
+        return [name for name in self._requested
+                if sys.modules.get(name) is not None]
+
+
+RECORDER = Recorder()
+
+
+def format_profile(names):
+    """Return an import profile: one module name per line, in the
+    order they should be imported.  Blank lines and lines starting
+    with # are ignored."""
+    lines = ['# pepperbox import profile for {}'.format(PY_TAG)]
+    lines.extend(names)
+    return '\n'.join(lines) + '\n'
+
+
+def write_profile(fileobj, names):
+    fileobj.write(format_profile(names))
+
+
+def read_profile(fileobj):
+    names = []
+    for line in fileobj:
+        line = line.strip()
+        if line and not line.startswith('#'):
+            names.append(line)
+    return names
+
+
+def merge(profiles):
+    """Combine several lists of names into one, keeping the order in
+    which each name first appears."""
+    merged = collections.OrderedDict()
+    for names in profiles:
+        for name in names:
+            merged[name] = None
+    return list(merged)
+
+
+def main(argv=None):
+    from . import telemetry
+
+    parser = argparse.ArgumentParser(
+        prog='python -m pepperbox.importlog',
+        description='Merge the import profiles sent over telemetry '
+        "channels into one for install's import_profile argument.")
+    parser.add_argument('-o', '--output', required=True,
+                        help='the profile to write')
+    parser.add_argument('--merge', action='store_true',
+                        help='include the names already in the output')
+    parser.add_argument('telemetry', nargs='+',
+                        help='files of telemetry records')
+    args = parser.parse_args(argv)
+
+    profiles = []
+    if args.merge:
+        try:
+            with open(args.output) as f:
+                profiles.append(read_profile(f))
+        except IOError:
+            pass
+    for path in args.telemetry:
+        with open(path, 'rb') as f:
+            for kind, payload in telemetry.read_records(f):
+                if kind == telemetry.IMPORTS:
+                    profiles.append(read_profile(
+                        payload.decode('utf-8').splitlines()))
+
+    with open(args.output, 'w') as f:
+        write_profile(f, merge(profiles))
+
+
+if __name__ == '__main__':
+    main()
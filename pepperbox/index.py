@@ -0,0 +1,155 @@
+import argparse
+import marshal
+import os
+import re
+import stat
+import sys
+
+from .support import PY_TAG
+
+
+MANIFEST_MAGIC = 'PBXM'
+MANIFEST_VERSION = 1
+
+_IDENTIFIER = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+
+class BadManifest(Exception):
+    pass
+
+
+class ModuleIndex(object):
+    """Maps top-level module names to the finders, in sys.path order,
+    whose directories contain them, so that finding a module costs a
+    dict lookup instead of a probe of every sys.path entry.
+
+    :param finders: the per-directory finders, in sys.path order.
+    """
+
+    def __init__(self, finders):
+        self.finders = list(finders)
+        self.rebuild()
+
+    def rebuild(self):
+        self._order = {}
+        self._roots = {}
+        self._owners = {}
+        for i, finder in enumerate(self.finders):
+            self._order.setdefault(finder.path, i)
+            self._roots.setdefault(finder.path, finder)
+            for name in finder.top_level_names():
+                self._owners.setdefault(name, []).append(finder)
+
+    def _roots_containing(self, entry):
+        head = os.path.normpath(entry)
+        while True:
+            finder = self._roots.get(head)
+            if finder is not None:
+                yield finder
+            head, tail = os.path.split(head)
+            if not tail:
+                break
+
+    def finders_for(self, fullname, path=None):
+        """Return the finders that should be asked for fullname, in
+        sys.path order.
+
+        Top-level modules are looked up by name.  Submodules are
+        searched for by the finders whose directories contain an
+        entry of their parent package's __path__.
+        """
+        if path is None:
+            return self._owners.get(fullname, ())
+
+        finders = set()
+        for entry in path:
+            finders.update(self._roots_containing(entry))
+        return sorted(finders, key=lambda finder: self._order[finder.path])
+
+
+def scan(path):
+    """Walk the package directories beneath path and return their
+    listings in the form DirectoryFD.seed accepts.  Every entry is
+    recorded as [S_IFMT type, size, mtime].
+    """
+    listings = {}
+    pending = [os.curdir]
+    while pending:
+        relpath = pending.pop()
+        dirpath = os.path.join(path, relpath)
+        try:
+            dirst = os.stat(dirpath)
+            names = os.listdir(dirpath)
+        except OSError:
+            continue
+
+        entries = {}
+        for name in names:
+            try:
+                st = os.stat(os.path.join(dirpath, name))
+            except OSError:
+                continue
+            kind = stat.S_IFMT(st.st_mode)
+            entries[name] = [kind, st.st_size, st.st_mtime]
+            if (kind == stat.S_IFDIR and name != '__pycache__'
+                    and _IDENTIFIER.match(name)):
+                pending.append(os.path.normpath(os.path.join(relpath, name)))
+
+        listings[relpath] = (dirst.st_dev, dirst.st_ino, dirst.st_mtime,
+                             entries)
+    return listings
+
+
+def _header():
+    return '{} {} {}\n'.format(MANIFEST_MAGIC, MANIFEST_VERSION,
+                               PY_TAG).encode('ascii')
+
+
+def write_manifest(fileobj, paths):
+    """Write a manifest of the directories in paths to fileobj."""
+    entries = dict((os.path.abspath(path), scan(path)) for path in paths
+                   if os.path.isdir(path))
+    fileobj.write(_header())
+    marshal.dump(entries, fileobj)
+
+
+def load_manifest(fileobj):
+    """Read a manifest written by write_manifest, returning a dict
+    that maps each directory to its listings.
+
+    Raises BadManifest if it was written by a different version of
+    pepperbox or for a different interpreter.
+    """
+    header = fileobj.readline()
+    if header != _header():
+        raise BadManifest('unexpected manifest header {!r}'.format(header))
+    return marshal.loads(fileobj.read())
+
+
+def seed_finders(finders, manifest):
+    """Seed each finder's directory with the listings manifest
+    recorded for it."""
+    for finder in finders:
+        listings = manifest.get(os.path.abspath(finder.path))
+        if listings is not None:
+            finder.dirobj.seed(listings)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m pepperbox.index',
+        description='Write a manifest of the modules on sys.path for '
+        "pepperbox.loader.install's manifest argument.")
+    parser.add_argument('-o', '--output', required=True,
+                        help='the manifest file to write')
+    parser.add_argument('paths', nargs='*',
+                        help='the directories to include '
+                        '(default: sys.path)')
+    args = parser.parse_args(argv)
+
+    with open(args.output, 'wb') as f:
+        write_manifest(f, args.paths or sys.path)
+
+
+if __name__ == '__main__':
+    main()
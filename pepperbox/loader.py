@@ -1,17 +1,209 @@
 import sys
 import os
 
+from . import _ffi
+from .image import open_image
+from .importlog import RECORDER, read_profile
+from .prefetch import Prefetcher
+from .preimport import precompile, preimport
+from .index import load_manifest, seed_finders
+from .support import (BaseOpenatFileFinder, LazyPolicy, OpenatPathHook,
+                      STATS, split_zip_path)
+from .trace import TRACER, sink_from_environment
+
 
 if sys.version_info.major > 2:
-    from .py34.loader import OpenatFileFinder
+    from .py34.loader import (OpenatFileFinder, IndexedOpenatFileFinder,
+                              OpenatImageFinder, OpenatZipFinder,
+                              OpenatPathEntryFinder, BASE_META_PATH, locate)
 else:
-    from .py27.loader import OpenatFileFinder
+    from .py27.loader import (OpenatFileFinder, IndexedOpenatFileFinder,
+                              OpenatImageFinder, OpenatZipFinder,
+                              OpenatPathEntryFinder, BASE_META_PATH, locate)
+
+
+def warm(names):
+    """Store the code of each named module, and of the packages
+    containing it, in the code cache that the openat loaders consult
+    before reading any source or bytecode.  Nothing is imported.
+    """
+    for name in names:
+        parts = name.split('.')
+        path = None
+        for i in range(1, len(parts) + 1):
+            fullname = '.'.join(parts[:i])
+            loader, path = locate(fullname, path)
+            if hasattr(loader, 'warm'):
+                loader.warm(fullname)
+            if path is None:
+                break
+
+
+def _openat_finders(meta_path, path_hooks=()):
+    for finder in meta_path:
+        if isinstance(finder, BaseOpenatFileFinder):
+            yield finder
+        elif isinstance(finder, IndexedOpenatFileFinder):
+            for indexed in finder.index.finders:
+                yield indexed
+    for hook in path_hooks:
+        if isinstance(hook, OpenatPathHook):
+            for finder in hook.finders:
+                yield finder
+
+
+def stats():
+    """Return pepperbox's counters as a dict.
+
+    dirfds_opened, dirfds_closed and dirfds_held count directory
+    descriptors; bytes_read counts the bytes of source and bytecode
+    read; code_compiled, code_unmarshalled and code_cached count code
+    objects by where they came from; and extensions_loaded counts
+    extension modules loaded with fdlopen.  finders lists the lookups,
+    hits and misses of each sys.path entry's finder on sys.meta_path
+    or sys.path_hooks.
+    """
+    counters = STATS.as_dict()
+    counters['finders'] = [finder.stats()
+                           for finder in _openat_finders(sys.meta_path,
+                                                         sys.path_hooks)]
+    return counters
+
+
+def install(rights, preimports=(), index=False, manifest=None,
+            max_dirfds=BaseOpenatFileFinder.MAX_DIRFDS, warm_modules=(),
+            image=None, trace=None, lazy=None, record=False,
+            import_profile=None, replay='preimport', parallel=None,
+            mode='meta_path'):
+    """Replace sys.meta_path with finders that only use the
+    directories and zip archives on sys.path through descriptors
+    limited to rights.
+
+    :param rights: the spyce rights objects to limit each directory's
+    descriptor with.
+
+    :param preimports: modules to import with the standard import
+    machinery before the finders are installed.
+
+    :param index: if true, list every sys.path directory now and
+    install a single finder that dispatches each import straight to
+    the directory that provides it.
+
+    :param manifest: the path to a manifest written by ``python -m
+    pepperbox.index``.  Directories whose stat still matches the
+    manifest are never listed.
+
+    :param max_dirfds: the most package directory descriptors each
+    sys.path entry's finder keeps open at once.
+
+    :param warm_modules: modules whose code should be compiled now,
+    before the sandbox is entered, and kept in memory for when
+    they're imported.  See warm.
+
+    :param image: the path to an image written by ``python -m
+    pepperbox.image``, or a descriptor open on one, such as
+    pepperbox.image.build_memfd returns.  Its modules are mapped into
+    memory and take precedence over those on sys.path.  Extension
+    modules in it are copied into anonymous in-memory files now, and
+    loaded from those with fdlopen.
+
+    :param trace: a callable passed an event dict for each phase of
+    every import; see pepperbox.trace.Tracer.  If it's not given and
+    the PEPPERBOX_TRACE environment variable names a file, events are
+    appended to it as JSON lines.
+
+    :param lazy: run modules' code only when one of their attributes
+    is first used.  True makes every source and bytecode module lazy;
+    a pepperbox.support.LazyPolicy chooses them by name.  Extension
+    modules are always loaded eagerly.
+
+    :param record: note every module imported after the finders are
+    installed; see pepperbox.importlog.
+
+    :param import_profile: the path to a profile of modules, such as
+    one made from a recording by ``python -m pepperbox.importlog``.
+
+    :param replay: what to do with the profile's modules: preimport
+    them, warm their code into the code cache, or prefetch their
+    files' contents to be there when they're imported.  Modules that
+    can no longer be found are skipped.  Prefetching isn't done in
+    the background: the files are read on a pool of threads, but
+    install waits for every one of them, and up to a quarter of
+    pepperbox.restrict.RSS_LIMIT of their contents is then held
+    until they're imported.
+
+    :param parallel: the number of threads to import the preimports,
+    and a preimport replay's modules, on; see
+    pepperbox.preimport.preimport.  Before they're imported, the
+    bytecode their sources lack is written by as many processes.  By
+    default they're imported one at a time.
 
+    :param mode: how the finders are installed.  meta_path replaces
+    sys.meta_path with them.  path_hooks instead makes them the only
+    entry on sys.path_hooks, and fills sys.path_importer_cache for
+    every sys.path entry.  The standard path finder then does the
+    dispatching and caching per entry, and builtin and frozen modules
+    are found once, up front, instead of by every finder.  index
+    requires meta_path.
+    """
+    if replay not in ('preimport', 'warm', 'prefetch'):
+        raise ValueError('replay must be preimport, warm or prefetch, '
+                         'not {!r}'.format(replay))
+    if mode not in ('meta_path', 'path_hooks'):
+        raise ValueError('mode must be meta_path or path_hooks, '
+                         'not {!r}'.format(mode))
+    if index and mode != 'meta_path':
+        raise ValueError('index requires mode meta_path')
+    profiled = []
+    if import_profile is not None:
+        with open(import_profile) as f:
+            profiled = read_profile(f)
 
-def install(rights, preimports=()):
-    for preimport in preimports:
-        __import__(preimport)
-    meta_path = [OpenatFileFinder(entry, rights)
-                 for entry in sys.path
-                 if os.path.isdir(entry)]
+    if trace is None:
+        trace = sink_from_environment()
+    if trace is not None:
+        TRACER.enable(trace)
+    replayed = profiled if replay == 'preimport' else []
+    if parallel:
+        precompile(list(preimports) + replayed, parallel)
+    preimport(preimports, parallel or 1)
+    preimport(replayed, parallel or 1, ignore=(ImportError,))
+    # before any openat finder might be asked to load it
+    _ffi.load()
+    if lazy is True:
+        lazy = LazyPolicy()
+    meta_path = []
+    for entry in sys.path:
+        if os.path.isdir(entry):
+            finder = OpenatFileFinder
+        elif split_zip_path(entry) is not None:
+            finder = OpenatZipFinder
+        else:
+            continue
+        meta_path.append(finder(entry, rights, max_dirfds, lazy or None))
+    if manifest is not None:
+        with open(manifest, 'rb') as f:
+            seed_finders(meta_path, load_manifest(f))
+    if index:
+        meta_path = [IndexedOpenatFileFinder(meta_path)]
+    if mode == 'path_hooks':
+        hook = OpenatPathHook(meta_path, OpenatPathEntryFinder)
+        sys.path_hooks[:] = [hook]
+        sys.path_importer_cache.clear()
+        for entry in sys.path:
+            sys.path_importer_cache[entry] = hook(entry)
+        meta_path = list(BASE_META_PATH)
+    if image is not None:
+        meta_path.insert(0, OpenatImageFinder(open_image(image)))
     sys.meta_path = meta_path
+    warm(list(warm_modules) + (profiled if replay == 'warm' else []))
+    if replay == 'prefetch' and profiled:
+        prefetcher = Prefetcher()
+        try:
+            prefetcher.prefetch(profiled)
+        finally:
+            # the reading threads mustn't outlive install: restrict()
+            # sandboxes the process as soon as it returns
+            prefetcher.close()
+    if record:
+        RECORDER.start()
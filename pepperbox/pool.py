@@ -0,0 +1,239 @@
+import collections
+import json
+import os
+import pickle
+import resource
+import select
+import socket
+import struct
+
+
+_FRAME = struct.Struct('!I')
+
+Result = collections.namedtuple('Result', 'ok value')
+
+
+def _send(sock, payload):
+    sock.sendall(_FRAME.pack(len(payload)) + payload)
+
+
+def _recv_exactly(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(size)
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def _recv(sock):
+    """Return the next frame's payload, or None if the other end has
+    gone away."""
+    header = _recv_exactly(sock, _FRAME.size)
+    if header is None:
+        return None
+    (size,) = _FRAME.unpack(header)
+    return _recv_exactly(sock, size)
+
+
+def _run(func, args):
+    try:
+        value = func(*args)
+        json.dumps(value)
+    except Exception as e:
+        return [False, '{}: {}'.format(type(e).__name__, e)]
+    return [True, value]
+
+
+def _out_of_cpu(margin):
+    soft, _ = resource.getrlimit(resource.RLIMIT_CPU)
+    if soft == resource.RLIM_INFINITY:
+        return False
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime >= soft - margin
+
+
+def _serve(sock, inherited, max_jobs, cpu_margin):
+    """A worker's main loop: run batches of pickled (func, args) jobs
+    until the pool hangs up, max_jobs have run, or RLIMIT_CPU is
+    within cpu_margin seconds."""
+    # other workers' sockets were inherited from the pool
+    for fd in inherited:
+        os.close(fd)
+
+    done = 0
+    while True:
+        frame = _recv(sock)
+        if frame is None:
+            return
+        batch = pickle.loads(frame)
+        results = [_run(func, args) for func, args in batch]
+        done += len(batch)
+        retiring = done >= max_jobs or _out_of_cpu(cpu_margin)
+        _send(sock, json.dumps([results, retiring]).encode('utf-8'))
+        if retiring:
+            return
+
+
+class _Worker(object):
+
+    def __init__(self, pid, sock):
+        self.pid = pid
+        self.sock = sock
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def stop(self):
+        self.sock.close()
+        os.waitpid(self.pid, 0)
+
+
+class Pool(object):
+    """Keeps a number of sandboxed workers alive and runs jobs in
+    them.
+
+    Jobs travel to the workers pickled, over a socket pair per
+    worker.  Results come back as JSON so that a compromised worker
+    can't run code in the pool's process; they must be JSON
+    serializable.  A worker is replaced once it has run max_jobs jobs,
+    once its CPU time is within cpu_margin seconds of RLIMIT_CPU, or
+    when it dies.
+
+    :param workers: the number of workers to keep.
+
+    :param zygote: the pepperbox.zygote.Zygote that forks the
+    workers.  It must be given: creating one installs the openat
+    finders in this process, replacing sys.meta_path.
+
+    :param batch_size: the number of jobs sent to a worker at once.
+    Larger batches amortize the round trips but fail together if a
+    worker dies.
+    """
+
+    def __init__(self, workers, zygote, max_jobs=1000, batch_size=1,
+                 cpu_margin=1.0):
+        self.zygote = zygote
+        self.max_jobs = max_jobs
+        self.batch_size = batch_size
+        self.cpu_margin = cpu_margin
+        self._workers = []
+        self._imap = None
+        for _ in range(workers):
+            self._workers.append(self._start())
+
+    def _start(self):
+        sock, child_sock = socket.socketpair()
+        inherited = [worker.fileno() for worker in self._workers]
+        inherited.append(sock.fileno())
+        pid = self.zygote.spawn(_serve, child_sock, inherited,
+                                self.max_jobs, self.cpu_margin)
+        child_sock.close()
+        return _Worker(pid, sock)
+
+    def _replace(self, worker):
+        worker.stop()
+        self._workers.remove(worker)
+        replacement = self._start()
+        self._workers.append(replacement)
+        return replacement
+
+    def _batches(self, func, iterable):
+        batch = []
+        for item in iterable:
+            batch.append((func, (item,)))
+            if len(batch) == self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def imap(self, func, iterable):
+        """Yield a Result for func(item) for each item, in order, as
+        the workers finish them.  Starting another imap or map
+        abandons this one if it's unfinished."""
+        if self._imap is not None:
+            self._imap.close()
+        self._imap = self._results(func, iterable)
+        return self._imap
+
+    def _collect(self, worker, size):
+        """Read worker's reply to a batch of size jobs.  Returns the
+        batch's Results and the worker to use from now on."""
+        reply = _recv(worker.sock)
+        if reply is None:
+            return self._died(worker, size)
+        results, retiring = json.loads(reply.decode('utf-8'))
+        if retiring:
+            worker = self._replace(worker)
+        return [Result(*result) for result in results], worker
+
+    def _died(self, worker, size):
+        """Fail a batch of size jobs that worker died before running,
+        and replace it."""
+        message = 'worker {} died'.format(worker.pid)
+        return [Result(False, message)] * size, self._replace(worker)
+
+    def _results(self, func, iterable):
+        batches = enumerate(self._batches(func, iterable))
+        idle = list(self._workers)
+        busy = {}
+        finished = {}
+        next_batch = 0
+        exhausted = False
+
+        try:
+            while True:
+                while idle and not exhausted:
+                    try:
+                        i, batch = next(batches)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    worker = idle.pop()
+                    try:
+                        _send(worker.sock, pickle.dumps(batch, -1))
+                    except (IOError, OSError):
+                        # it died while idle
+                        finished[i], worker = self._died(worker,
+                                                         len(batch))
+                        idle.append(worker)
+                    else:
+                        busy[worker] = (i, len(batch))
+
+                while next_batch in finished:
+                    for result in finished.pop(next_batch):
+                        yield result
+                    next_batch += 1
+
+                if not busy:
+                    return
+
+                ready, _, _ = select.select(list(busy), [], [])
+                for worker in ready:
+                    i, size = busy.pop(worker)
+                    finished[i], worker = self._collect(worker, size)
+                    idle.append(worker)
+        finally:
+            # if this was abandoned, read the replies still on their
+            # way, so a later imap doesn't take them for its own
+            for worker, (_, size) in busy.items():
+                self._collect(worker, size)
+
+    def map(self, func, iterable):
+        return list(self.imap(func, iterable))
+
+    def close(self):
+        if self._imap is not None:
+            self._imap.close()
+        for worker in self._workers:
+            worker.stop()
+        self._workers = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,116 @@
+import itertools
+import os
+import sys
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from .restrict import RSS_LIMIT
+from .support import BadPath, PREFETCHED
+
+if sys.version_info.major > 2:
+    from .py34.loader import locate, prefetch_paths
+else:
+    from .py27.loader import locate, prefetch_paths
+
+
+# shared by every Prefetcher, so that PREFETCHED sees one import order
+_ORDER = itertools.count()
+
+
+class Prefetcher(object):
+    """Reads the files of modules that are about to be imported on a
+    pool of threads, so that the loaders find their contents waiting
+    in support.PREFETCHED instead of waiting on the disk.
+
+    Modules are found on the calling thread, with the finders on
+    sys.meta_path; only the reading happens in the background.  The
+    threads open files through descriptors of their own, so the
+    finders can release theirs at any time.
+
+    :param threads: the number of reading threads.
+
+    :param max_bytes: stop keeping file contents once this many bytes
+    have been read.  Files read past that point are still read, which
+    leaves them in the page cache.  The default is a quarter of the
+    resident set size restrict() allows.
+    """
+
+    def __init__(self, threads=4, max_bytes=RSS_LIMIT // 4):
+        self.max_bytes = max_bytes
+        self.fetched = 0
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._dirobjs = {}
+        self._threads = [threading.Thread(target=self._work)
+                         for _ in range(threads)]
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+
+    def _dirobj(self, dirobj):
+        # a descriptor of the prefetcher's own, which the finder's
+        # LRU can't close from under the threads
+        own = self._dirobjs.get(dirobj.name)
+        if own is None:
+            own = self._dirobjs[dirobj.name] = dirobj.opendir(os.curdir)
+        return own
+
+    def prefetch(self, names):
+        """Queue the files of each named module, and of the packages
+        containing it, to be read.  Returns without waiting for
+        them."""
+        seen = set()
+        for name in names:
+            parts = name.split('.')
+            path = None
+            for i in range(1, len(parts) + 1):
+                fullname = '.'.join(parts[:i])
+                loader, path = locate(fullname, path)
+                if fullname not in seen:
+                    seen.add(fullname)
+                    for dirobj, filename in prefetch_paths(loader):
+                        self._queue.put((self._dirobj(dirobj), filename,
+                                         next(_ORDER)))
+                if path is None:
+                    break
+
+    def _work(self):
+        while True:
+            task = self._queue.get()
+            try:
+                if task is None:
+                    return
+                self._read(*task)
+            finally:
+                self._queue.task_done()
+
+    def _read(self, dirobj, filename, order):
+        try:
+            with dirobj.open(filename) as f:
+                data = f.read()
+        except (IOError, OSError, BadPath):
+            return
+        with self._lock:
+            keep = self.fetched + len(data) <= self.max_bytes
+            self.fetched += len(data)
+        if keep:
+            PREFETCHED.put(filename, order, data)
+
+    def wait(self):
+        """Block until every queued file has been read."""
+        self._queue.join()
+
+    def close(self):
+        """Stop the threads once the queue is empty, and close the
+        prefetcher's descriptors."""
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        for dirobj in self._dirobjs.values():
+            dirobj.close()
+        self._dirobjs.clear()
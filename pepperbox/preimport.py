@@ -0,0 +1,115 @@
+import multiprocessing
+import py_compile
+import sys
+from multiprocessing.pool import ThreadPool
+
+if sys.version_info.major > 2:
+    from importlib._bootstrap import _DeadlockError
+    from .py34.loader import stale_source
+else:
+    from .py27.loader import stale_source
+
+    class _DeadlockError(Exception):
+        """Python 2's import lock is global, so imports between
+        threads never deadlock."""
+
+
+def stale_sources(names):
+    """Return the source files of the named modules, and of the
+    packages containing them, that have no up to date bytecode."""
+    sources = []
+    seen = set()
+    for name in names:
+        parts = name.split('.')
+        path = None
+        for i in range(1, len(parts) + 1):
+            fullname = '.'.join(parts[:i])
+            source, path = stale_source(fullname, path)
+            if fullname not in seen:
+                seen.add(fullname)
+                if source is not None:
+                    sources.append(source)
+            if path is None:
+                break
+    return sources
+
+
+def _compile(source):
+    try:
+        py_compile.compile(source, doraise=True)
+    except (py_compile.PyCompileError, IOError, OSError):
+        return False
+    return True
+
+
+def precompile(names, processes=None):
+    """Write bytecode for the named modules whose sources lack it, on
+    a pool of processes, so that importing them only unmarshals it.
+    Sources that can't be compiled, or whose bytecode can't be
+    written, are left for the import to deal with.  Nothing is written
+    if sys.dont_write_bytecode is set, or if the bytecode is current,
+    and no processes are started unless there's more than one source
+    to compile.
+
+    Returns the number of files compiled.
+    """
+    if sys.dont_write_bytecode:
+        return 0
+    sources = stale_sources(names)
+    if len(sources) < 2 or processes == 1:
+        return sum(map(_compile, sources))
+    pool = multiprocessing.Pool(min(processes or len(sources),
+                                    len(sources)))
+    try:
+        return sum(pool.map(_compile, sources))
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _try_import(name):
+    try:
+        __import__(name)
+    except Exception as e:
+        return e
+    return None
+
+
+def preimport(names, threads=1, ignore=()):
+    """Import each named module.
+
+    With more than one thread, the modules are imported on a pool of
+    threads so their files are read concurrently; the import system's
+    per-module locks keep each from running twice.  A module whose
+    import failed has already run some of its code, so it isn't
+    imported again: the first such failure, in the order given, is
+    raised.  The exception is a deadlock between threads importing
+    modules that import each other, which is resolved by importing
+    the module again on the calling thread, unless another thread has
+    since imported it.
+
+    :param ignore: exception types to swallow, rather than raise, for
+    modules that can't be imported.
+    """
+    names = list(names)
+    if threads > 1 and len(names) > 1:
+        pool = ThreadPool(threads)
+        try:
+            failures = pool.map(_try_import, names)
+        finally:
+            pool.close()
+            pool.join()
+        retry = []
+        for name, failure in zip(names, failures):
+            if failure is None or name in sys.modules:
+                continue
+            if isinstance(failure, _DeadlockError):
+                retry.append(name)
+            elif not isinstance(failure, ignore):
+                raise failure
+        names = retry
+    for name in names:
+        try:
+            __import__(name)
+        except ignore:
+            pass
@@ -0,0 +1,111 @@
+import atexit
+import os
+import signal
+
+from . import telemetry
+
+
+OVERFLOW = '[overflow]'
+
+
+def fold(frame, max_depth):
+    """Return frame's stack, outermost call first, as a folded stack:
+    semicolon separated "function (filename:line)" entries, where line
+    is the first line of the function."""
+    names = []
+    while frame is not None and len(names) < max_depth:
+        code = frame.f_code
+        names.append('{} ({}:{})'.format(code.co_name, code.co_filename,
+                                         code.co_firstlineno))
+        frame = frame.f_back
+    names.reverse()
+    return ';'.join(names)
+
+
+class Sampler(object):
+    """Samples the main thread's stack every interval seconds of CPU
+    time, counting each distinct folded stack.
+
+    At most max_stacks distinct stacks are kept, so memory use is
+    bounded no matter how long the process runs; samples of stacks
+    that don't fit are counted under OVERFLOW.
+
+    :param max_depth: the most frames, counted from the innermost,
+    kept of each stack.
+    """
+
+    def __init__(self, interval=0.01, max_stacks=1024, max_depth=64):
+        self.interval = interval
+        self.max_stacks = max_stacks
+        self.max_depth = max_depth
+        self.stacks = {}
+        self.overflow = 0
+        self._previous = None
+
+    def _sample(self, signum, frame):
+        stack = fold(frame, self.max_depth)
+        if stack in self.stacks:
+            self.stacks[stack] += 1
+        elif len(self.stacks) < self.max_stacks:
+            self.stacks[stack] = 1
+        else:
+            self.overflow += 1
+
+    def start(self):
+        self._previous = signal.signal(signal.SIGPROF, self._sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self):
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        if self._previous is not None:
+            signal.signal(signal.SIGPROF, self._previous)
+            self._previous = None
+
+    def folded(self):
+        """Return the samples in the folded format flame graph tools
+        read: one "stack count" line per stack."""
+        lines = ['{} {}'.format(stack, count)
+                 for stack, count in sorted(self.stacks.items())]
+        if self.overflow:
+            lines.append('{} {}'.format(OVERFLOW, self.overflow))
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, channel):
+        """Stop sampling and send the folded stacks to the telemetry
+        channel as a PROFILE record."""
+        self.stop()
+        return channel.send(telemetry.PROFILE,
+                            self.folded().encode('utf-8'))
+
+
+def _dump_and_die(sampler, channel):
+
+    def handler(signum, frame):
+
+        def die():
+            sampler.dump(channel)
+            channel.drain()
+            # die of the signal as though it had never been caught
+            signal.signal(signum, signal.SIG_DFL)
+            os.kill(os.getpid(), signum)
+
+        # the signal may have interrupted a send, which has to finish
+        # before the profile can be queued behind it
+        channel.defer(die)
+
+    return handler
+
+
+def start(channel, interval=0.01, **sampler_kwargs):
+    """Start sampling the process's stack, sending the folded stacks
+    to the telemetry channel when the process exits.  If RLIMIT_CPU's
+    soft limit is reached, they're sent before SIGXCPU kills it.
+    Returns the Sampler.
+
+    Call this before entering capability mode.
+    """
+    sampler = Sampler(interval, **sampler_kwargs)
+    signal.signal(signal.SIGXCPU, _dump_and_die(sampler, channel))
+    atexit.register(sampler.dump, channel)
+    sampler.start()
+    return sampler
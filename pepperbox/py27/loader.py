@@ -6,9 +6,14 @@ import os
 import sys
 import struct
 import marshal
+import types
 from .._ffi import fdlopen, RTLD_NOW, dlsym, make_callable_with_gil
-from .support import INITMODULEFUNC
-from ..support import BaseOpenatFileFinder, _Py_PackageContext
+from .support import INITMODULEFUNC, map_or_read
+from ..support import (BaseOpenatFileFinder, _Py_PackageContext, CODE_CACHE,
+                       MMAP_THRESHOLD, STATS, PREFETCHED, ZipDirectory)
+from ..index import ModuleIndex
+from ..image import EXTENSION
+from ..trace import TRACER
 
 callable_with_gil = make_callable_with_gil(INITMODULEFUNC)
 
@@ -26,12 +31,18 @@ class OpenatLoader(object):
                          shortname):  # pragma: no cover
         raise NotImplementedError
 
-    def load_module(self, fullname):
-        if fullname in sys.modules:
-            module = sys.modules[fullname]
-        else:
-            sys.modules[fullname] = module = imp.new_module(fullname)
+    def warm(self, fullname):
+        pass
+
+    def get_data(self, path):
+        """Return the contents of path, a file beneath this module's
+        directory, for pkgutil.get_data."""
+        with self.dirobj.open(path) as f:
+            return f.read()
 
+    def _init_module(self, module, fullname):
+        """Set the attributes of module the import system expects,
+        and return its name without its parent packages."""
         package, _, module_name = fullname.rpartition('.')
 
         module.__file__ = os.path.join(self.dirobj.name, self.relpath)
@@ -54,24 +65,54 @@ class OpenatLoader(object):
         if package:
             sys.modules[package].__package__ = package
 
-        self._populate_module(module, fullname, module_name)
+        return module_name
+
+    def load_module(self, fullname):
+        if fullname in sys.modules:
+            module = sys.modules[fullname]
+        else:
+            sys.modules[fullname] = module = imp.new_module(fullname)
+
+        module_name = self._init_module(module, fullname)
+
+        with TRACER.span('exec', fullname):
+            self._populate_module(module, fullname, module_name)
 
         return module
 
 
 class PyOpenatLoader(OpenatLoader):
 
+    def get_code(self, fullname):
+        with TRACER.span('code', fullname) as span:
+            code = CODE_CACHE.get(self.dirobj, self.relpath)
+            if code is not None:
+                STATS.code_cached += 1
+                span.note(cached=True)
+                return code
+            filename = os.path.join(self.dirobj.name, self.relpath)
+            src = PREFETCHED.take(filename)
+            try:
+                if src is None:
+                    with TRACER.span('read', fullname), \
+                            self.dirobj.open(self.relpath) as f:
+                        src = f.read()
+                        TRACER.read(len(src))
+                STATS.bytes_read += len(src)
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+                raise ImportError(e)
+            STATS.code_compiled += 1
+            with TRACER.span('compile', fullname):
+                return compile(src, filename, 'exec')
+
+    def warm(self, fullname):
+        CODE_CACHE.put(self.dirobj, self.relpath, self.get_code(fullname))
+
     def _populate_module(self, module, fullname, shortname):
         sys.modules[fullname] = module
-        try:
-            with self.dirobj.open(self.relpath) as f:
-                src = f.read()
-        except OSError as e:
-            if e.errno != errno.ENOENT:
-                raise
-            raise ImportError(e)
-
-        exec src in module.__dict__
+        exec self.get_code(fullname) in module.__dict__
         return module
 
 
@@ -107,26 +148,41 @@ class PyCompiledOpenatLoader(OpenatLoader):
             if int(stat.st_mtime) & 0xFFFFFFFF != mtime:
                 raise LoadCompiledModuleFailure(ImportError())
 
+    def _check_header(self, f):
+        magic = self._read_marshal_long(f)
+        if magic is None or magic != self.MAGIC:
+            raise LoadCompiledModuleFailure(
+                ImportError('Bad magic number in '
+                            '{}'.format(self.relpath)))
+        mtime = self._read_marshal_long(f)
+        if mtime is None:
+            raise LoadCompiledModuleFailure(EOFError())
+
+        self._ensure_mtime_ok(mtime)
+
+    def _open_failure(self, e):
+        if e.errno != errno.ENOENT:
+            return LoadCompiledModuleFailure(e)
+        return LoadCompiledModuleFailure(ImportError(e))
+
     def wrapped_load_module(self, fullname):
         try:
             with self.dirobj.open(self.relpath) as f:
                 self.fileobj = f
-                magic = self._read_marshal_long(f)
-                if magic is None or magic != self.MAGIC:
-                    raise LoadCompiledModuleFailure(
-                        ImportError('Bad magic number in '
-                                    '{}'.format(self.relpath)))
-                mtime = self._read_marshal_long(f)
-                if mtime is None:
-                    raise LoadCompiledModuleFailure(EOFError())
-
-                self._ensure_mtime_ok(mtime)
+                self._check_header(f)
                 return super(PyCompiledOpenatLoader,
                              self).load_module(fullname)
         except OSError as e:
-            if e.errno != errno.ENOENT:
-                raise LoadCompiledModuleFailure(e)
-            raise LoadCompiledModuleFailure(ImportError(e))
+            raise self._open_failure(e)
+
+    def wrapped_get_code(self, fullname):
+        try:
+            with TRACER.span('code', fullname), \
+                    self.dirobj.open(self.relpath) as f:
+                self._check_header(f)
+                return self._unmarshal(f, fullname)
+        except OSError as e:
+            raise self._open_failure(e)
 
     def load_module(self, fullname):
         try:
@@ -134,9 +190,23 @@ class PyCompiledOpenatLoader(OpenatLoader):
         except LoadCompiledModuleFailure as e:
             raise e.real_exc
 
+    def get_code(self, fullname):
+        try:
+            return self.wrapped_get_code(fullname)
+        except LoadCompiledModuleFailure as e:
+            raise e.real_exc
+
+    def _unmarshal(self, f, fullname):
+        with TRACER.span('read', fullname):
+            data = map_or_read(f, MMAP_THRESHOLD, 2 * self.MARSHAL_LONG.size)
+            STATS.bytes_read += len(data)
+            TRACER.read(len(data))
+        STATS.code_unmarshalled += 1
+        return marshal.loads(data)
+
     def _populate_module(self, module, fullname, shortname):
         sys.modules[fullname] = module
-        exec marshal.load(self.fileobj) in module.__dict__
+        exec self._unmarshal(self.fileobj, fullname) in module.__dict__
         return module
 
 
@@ -150,40 +220,107 @@ class TryPycThenPyOpenatLoader(object):
     def __getattr__(self, attr):
         return getattr(self.py_loader, attr)
 
-    def load_module(self, *args, **kwargs):
+    def get_code(self, fullname):
         try:
-            return self.pyc_loader.wrapped_load_module(*args, **kwargs)
+            return self.pyc_loader.wrapped_get_code(fullname)
         except LoadCompiledModuleFailure:
-            return self.py_loader.load_module(*args, **kwargs)
+            return self.py_loader.get_code(fullname)
+
+    def warm(self, fullname):
+        CODE_CACHE.put(self.py_loader.dirobj, self.py_loader.relpath,
+                       self.get_code(fullname))
+
+    def load_module(self, *args, **kwargs):
+        # code warmed into the cache beats even valid bytecode
+        if CODE_CACHE.get(self.py_loader.dirobj,
+                          self.py_loader.relpath) is None:
+            try:
+                return self.pyc_loader.wrapped_load_module(*args, **kwargs)
+            except LoadCompiledModuleFailure:
+                pass
+        return self.py_loader.load_module(*args, **kwargs)
+
+
+# what the import system looks up on a module while importing it
+# and its submodules
+_LAZY_ATTRIBUTES = frozenset(['__name__', '__file__', '__path__',
+                              '__package__', '__loader__', '__class__'])
+
+
+class _LazyModule(types.ModuleType):
+    """A module whose code runs the first time an attribute other
+    than those the import system uses is looked up.
+
+    Python 2 can't change a module's class once its code has run, so
+    every attribute lookup pays for the check.
+    """
+
+    def __getattribute__(self, attr):
+        namespace = types.ModuleType.__getattribute__(self, '__dict__')
+        loader = namespace.get('__lazy_loader__')
+        if loader is not None and attr not in _LAZY_ATTRIBUTES:
+            del namespace['__lazy_loader__']
+            fullname = namespace['__name__']
+            with TRACER.span('exec', fullname):
+                exec loader.get_code(fullname) in namespace
+        return types.ModuleType.__getattribute__(self, attr)
+
+
+class LazyOpenatLoader(object):
+    """Wraps a source or bytecode loader so that its modules' code
+    runs only when they're first used."""
+
+    def __init__(self, loader):
+        self.loader = loader
+
+    def __getattr__(self, attr):
+        return getattr(self.loader, attr)
+
+    def load_module(self, fullname):
+        if fullname in sys.modules:
+            return self.loader.load_module(fullname)
+        sys.modules[fullname] = module = _LazyModule(fullname)
+        self.loader._init_module(module, fullname)
+        module.__dict__['__lazy_loader__'] = self.loader
+        return module
+
+
+def _init_extension(so_fd, module, fullname, shortname):
+    """fdlopen the extension module open on so_fd and run its init
+    function, which puts the module it creates in place of module in
+    sys.modules."""
+    gc.disable()
+    try:
+        loaded_so = fdlopen(so_fd, RTLD_NOW)
+        initmodule_pointer = dlsym(loaded_so, 'init%s' % shortname)
+        initmodule = callable_with_gil(initmodule_pointer)
+
+        # initmodule apparently unsets __file__, but leaves
+        # other attributes alone
+        __file__ = module.__file__
+
+        with _Py_PackageContext(fullname, shortname):
+            initmodule()
+        m = sys.modules[fullname]
+
+        m.__file__ = __file__
+        STATS.extensions_loaded += 1
+        return m
+    finally:
+        gc.enable()
 
 
 class RTLDOpenatLoader(OpenatLoader):
 
     def _populate_module(self, module, fullname, shortname):
-        gc.disable()
         try:
             with self.dirobj.open(self.relpath) as so:
-                so_fd = so.fileno()
-                loaded_so = fdlopen(so_fd, RTLD_NOW)
-                initmodule_pointer = dlsym(loaded_so, 'init%s' % shortname)
-                initmodule = callable_with_gil(initmodule_pointer)
-
-                # initmodule apparently unsets __file__, but leaves
-                # other attributes alone
-                __file__ = module.__file__
-
-                with _Py_PackageContext(fullname, shortname):
-                    initmodule()
-                m = sys.modules[fullname]
-
-                m.__file__ = __file__
-                return m
+                return _init_extension(so.fileno(), module, fullname,
+                                       shortname)
         except OSError as e:
             if e.errno != errno.ENOENT:
                 raise
             raise ImportError(e)
-        finally:
-            gc.enable()
 
 
 class OpenatFileFinder(BaseOpenatFileFinder):
@@ -193,6 +330,9 @@ class OpenatFileFinder(BaseOpenatFileFinder):
         if self.path != path:
             raise ImportError
 
+    def suffixes(self):
+        return [suffix for suffix, _, _ in self.SUFFIXES]
+
     def _find_loader(self, dirobj, fullname):
         _, _, module = fullname.rpartition('.')
 
@@ -217,10 +357,230 @@ class OpenatFileFinder(BaseOpenatFileFinder):
             return loader(dirobj, relpath, is_package)
 
     def find_module(self, fullname, path=None):
-        for dirobj in self.dirobjs_from_path(path):
-            loader = self._find_loader(dirobj, fullname)
+        self.lookups += 1
+        with TRACER.span('find', fullname, finder=self.path) as span:
+            key = self._miss_key(fullname, path)
+            if key in self._misses:
+                self.misses += 1
+                span.note(found=False, cached=True)
+                return None
+            for dirobj in self.dirobjs_from_path(path):
+                loader = self._find_loader(dirobj, fullname)
+                if loader:
+                    self.hits += 1
+                    span.note(found=True)
+                    return self._make_lazy(fullname, loader)
+            self.misses += 1
+            self._misses.add(key)
+            span.note(found=False)
+
+    def _make_lazy(self, fullname, loader):
+        # extension modules can't be deferred
+        if (self.lazy is not None and
+                not isinstance(loader, RTLDOpenatLoader) and
+                self.lazy(fullname)):
+            return LazyOpenatLoader(loader)
+        return loader
+
+    def __repr__(self):
+        return '<{} for {}">'.format(self.__class__.__name__, self.path)
+
+
+class OpenatPathEntryFinder(object):
+    """A path entry finder for sys.path_hooks that searches a
+    directory beneath an OpenatFileFinder's through its
+    descriptors."""
+
+    def __init__(self, finder, path):
+        self.finder = finder
+        self.path = path
+        self._search_path = None if path == finder.path else [path]
+
+    def find_module(self, fullname, path=None):
+        return self.finder.find_module(fullname, self._search_path)
+
+    def invalidate_caches(self):
+        self.finder.invalidate_caches()
+
+    def __repr__(self):
+        return '<{} for {}>'.format(self.__class__.__name__, self.path)
+
+
+# what sys.meta_path holds when imports are left to sys.path_hooks;
+# Python 2 finds builtin and frozen modules, and walks sys.path,
+# itself
+BASE_META_PATH = []
+
+
+class OpenatZipFinder(OpenatFileFinder):
+    """Finds modules in a zip archive on sys.path, or a directory
+    within one, through a ZipDirectory.  Like zipimport, it doesn't
+    look for extension modules."""
+    DIRECTORY = ZipDirectory
+    SUFFIXES = tuple(suffix for suffix in OpenatFileFinder.SUFFIXES
+                     if suffix[2] != imp.C_EXTENSION)
+
+
+class OpenatImageLoader(OpenatLoader):
+
+    def __init__(self, image, fullname):
+        entry = image.get(fullname)
+        super(OpenatImageLoader, self).__init__(image, entry.filename,
+                                                entry.is_package)
+        self.image = image
+
+    def get_code(self, fullname):
+        STATS.code_unmarshalled += 1
+        return self.image.code(fullname)
+
+    def get_source(self, fullname):
+        return self.image.source(fullname)
+
+    def _populate_module(self, module, fullname, shortname):
+        if self._is_package:
+            module.__path__ = [os.path.join(self.image.name,
+                                            *fullname.split('.'))]
+        module.__loader__ = self
+        sys.modules[fullname] = module
+        exec self.get_code(fullname) in module.__dict__
+        return module
+
+
+class OpenatImageExtensionLoader(OpenatImageLoader):
+
+    def get_code(self, fullname):
+        return None
+
+    def get_source(self, fullname):
+        return None
+
+    def _populate_module(self, module, fullname, shortname):
+        return _init_extension(self.image.extension_fd(fullname), module,
+                               fullname, shortname)
+
+
+class OpenatImageFinder(object):
+    """Finds modules in a pepperbox.image.Image, without touching the
+    file system.  Its extension modules are copied into memory when
+    the finder's created, to be loaded from there: by the time they're
+    imported, restrict() has set RLIMIT_FSIZE to 0, which forbids
+    writing the copies."""
+
+    def __init__(self, image):
+        self.image = image
+        image.open_extensions()
+
+    def find_module(self, fullname, path=None):
+        entry = self.image.get(fullname)
+        if entry is None:
+            return None
+        if entry.kind == EXTENSION:
+            return OpenatImageExtensionLoader(self.image, fullname)
+        return OpenatImageLoader(self.image, fullname)
+
+    def __repr__(self):
+        return '<{} for {}>'.format(self.__class__.__name__,
+                                    self.image.name)
+
+
+def _path_importers(path):
+    for entry in sys.path if path is None else path:
+        importer = sys.path_importer_cache.get(entry)
+        if importer is None:
+            for hook in sys.path_hooks:
+                try:
+                    importer = hook(entry)
+                except ImportError:
+                    continue
+                sys.path_importer_cache[entry] = importer
+                break
+        if importer is not None:
+            yield importer
+
+
+def locate(fullname, path=None):
+    """Find fullname with the finders on sys.meta_path, and then
+    those sys.path_hooks makes for each entry on path, without
+    importing it.  Returns its loader and submodule search locations,
+    or (None, None)."""
+    _, _, shortname = fullname.rpartition('.')
+    finders = [(finder, path) for finder in sys.meta_path]
+    finders.extend((importer, None) for importer in _path_importers(path))
+    for finder, search_path in finders:
+        loader = finder.find_module(fullname, search_path)
+        if loader is not None:
+            if loader.is_package(fullname):
+                return loader, [os.path.join(loader.dirobj.name, shortname)]
+            return loader, None
+    return None, None
+
+
+class IndexedOpenatFileFinder(object):
+    """A single meta path finder that dispatches to the
+    OpenatFileFinder for the sys.path entry that contains a module,
+    found through a ModuleIndex."""
+
+    def __init__(self, finders):
+        self.index = ModuleIndex(finders)
+
+    def find_module(self, fullname, path=None):
+        for finder in self.index.finders_for(fullname, path):
+            loader = finder.find_module(fullname, path)
             if loader:
                 return loader
 
+    def invalidate_caches(self):
+        for finder in self.index.finders:
+            finder.invalidate_caches()
+        self.index.rebuild()
+
     def __repr__(self):
-        return '<{} for {}">'.format(self.__class__.__name__, self.path)
+        return '<{} for {} entries>'.format(self.__class__.__name__,
+                                            len(self.index.finders))
+
+
+def prefetch_paths(loader):
+    """Return the files, as (dirobj, path) pairs, whose contents
+    loader will read.  Only source is taken from the prefetched
+    contents; bytecode is read through its file object."""
+    if isinstance(loader, LazyOpenatLoader):
+        loader = loader.loader
+    if isinstance(loader, TryPycThenPyOpenatLoader):
+        loader = loader.py_loader
+    if isinstance(loader, PyOpenatLoader):
+        return [(loader.dirobj,
+                 os.path.join(loader.dirobj.name, loader.relpath))]
+    return []
+
+
+def stale_source(fullname, path=None):
+    """Find fullname with imp.find_module, without importing it.
+    Returns the path of its source if that has no up to date
+    bytecode, or else None, and its submodule search locations."""
+    _, _, shortname = fullname.rpartition('.')
+    try:
+        f, pathname, (_, _, kind) = imp.find_module(shortname, path)
+    except ImportError:
+        return None, None
+    if f is not None:
+        f.close()
+    locations = None
+    if kind == imp.PKG_DIRECTORY:
+        locations = [pathname]
+        pathname = os.path.join(pathname, '__init__.py')
+    elif kind != imp.PY_SOURCE:
+        return None, None
+    if not os.path.isfile(pathname):
+        return None, locations
+    bytecode = pathname + ('c' if __debug__ else 'o')
+    # what the import checks is the source mtime the bytecode's
+    # header records, not the bytecode file's own mtime
+    try:
+        mtime = int(os.stat(pathname).st_mtime) & 0xFFFFFFFF
+        with open(bytecode, 'rb') as f:
+            header = f.read(8)
+    except (IOError, OSError):
+        return pathname, locations
+    if header == imp.get_magic() + struct.pack('<I', mtime):
+        return None, locations
+    return pathname, locations
@@ -1,5 +1,7 @@
 import ctypes
 import errno
+import io
+import mmap
 import os
 from fsnix import fs, util
 
@@ -17,6 +19,11 @@ class _DirectoryFD(util.directory):
         listing = super(_DirectoryFD, self).listdir()
         return listing[:len(listing) / 2]
 
+    def scandir(self):
+        # fsnix doesn't expose d_type, so every entry's type is
+        # resolved with a stat on demand
+        return [(name, None) for name in self.listdir()]
+
     def stat(self, path):
         return fs.fstatat(self.fileno(), path)
 
@@ -43,4 +50,20 @@ def fdopendir(fd, path):
                     fs.openat(fd, *args, **kwargs))
 
 
+def map_or_read(f, threshold, offset=0):
+    """Return a buffer of f's contents from offset on.  Files of at
+    least threshold bytes are mapped rather than copied into
+    memory."""
+    try:
+        size = os.fstat(f.fileno()).st_size
+    except io.UnsupportedOperation:
+        # already in memory, e.g. a member of a zip archive
+        size = None
+    if size is not None and size >= threshold:
+        return buffer(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ),
+                      offset)
+    f.seek(offset)
+    return f.read()
+
+
 INITMODULEFUNC = ctypes.PYFUNCTYPE(None)
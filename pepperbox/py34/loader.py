@@ -1,21 +1,33 @@
 import gc
 import _imp
 import ctypes
-from importlib.util import spec_from_file_location
-from importlib.abc import SourceLoader, MetaPathFinder
-from importlib.machinery import (ModuleSpec,
+import importlib.util
+from importlib.util import (spec_from_file_location, decode_source,
+                            cache_from_source)
+from importlib.abc import (SourceLoader, MetaPathFinder, InspectLoader,
+                           Loader)
+from importlib.machinery import (ModuleSpec, PathFinder,
+                                 SourceFileLoader,
                                  SourcelessFileLoader,
                                  ExtensionFileLoader,
                                  SOURCE_SUFFIXES, BYTECODE_SUFFIXES,
-                                 BuiltinImporter)
+                                 BuiltinImporter, FrozenImporter)
 import os
+import struct
+import sys
+import types
 from .._ffi import fdlopen, RTLD_NOW, dlsym, make_callable_with_gil
-from .support import INITMODULEFUNC
-from ..support import BaseOpenatFileFinder, _Py_PackageContext
+from .support import INITMODULEFUNC, map_or_read
+from ..support import (BaseOpenatFileFinder, _Py_PackageContext, CODE_CACHE,
+                       MMAP_THRESHOLD, STATS, PREFETCHED, ZipDirectory)
+from ..index import ModuleIndex
+from ..image import EXTENSION
+from ..trace import TRACER
 
 
 callable_with_gil = make_callable_with_gil(INITMODULEFUNC)
 
+_BYTECODE_SUFFIXES = tuple(BYTECODE_SUFFIXES)
 
 class OpenatLoader(SourceLoader):
     def __init__(self, fullname, path, dirobj):
@@ -24,15 +36,116 @@ class OpenatLoader(SourceLoader):
         self.path = path
         self.dirobj = dirobj
 
+    def get_code(self, fullname):
+        with TRACER.span('code', fullname) as span:
+            code = CODE_CACHE.get(self.dirobj, self.path)
+            if code is not None:
+                STATS.code_cached += 1
+                span.note(cached=True)
+                return code
+            # importlib unmarshals bytecode without calling back into
+            # the loader, so anything not compiled was unmarshalled
+            compiled = STATS.code_compiled
+            # importlib only slices and unmarshals the bytecode it
+            # reads here, both of which work on a view
+            self._view_bytecode = True
+            try:
+                code = super().get_code(fullname)
+            finally:
+                self._view_bytecode = False
+            if code is not None and STATS.code_compiled == compiled:
+                STATS.code_unmarshalled += 1
+            return code
+
+    def source_to_code(self, data, path, **kwargs):
+        STATS.code_compiled += 1
+        with TRACER.span('compile', self.name):
+            return super().source_to_code(data, path, **kwargs)
+
+    def exec_module(self, module):
+        with TRACER.span('exec', module.__name__):
+            super().exec_module(module)
+
+    def warm(self, fullname):
+        """Store this module's code in the code cache."""
+        code = self.get_code(fullname)
+        if code is not None:
+            CODE_CACHE.put(self.dirobj, self.path, code)
+
+
+# what the import system looks up on a module while importing it
+# and its submodules
+_LAZY_ATTRIBUTES = frozenset(['__name__', '__file__', '__path__',
+                              '__package__', '__loader__', '__spec__',
+                              '__cached__', '__class__'])
+
+
+class _LazyModule(types.ModuleType):
+    """A module whose code runs the first time an attribute other
+    than those the import system uses is looked up.
+
+    Python 3.4 can't change a module's class once its code has run,
+    so every attribute lookup pays for the check.
+    """
+
+    def __getattribute__(self, attr):
+        namespace = types.ModuleType.__getattribute__(self, '__dict__')
+        loader = namespace.get('__lazy_loader__')
+        if loader is not None and attr not in _LAZY_ATTRIBUTES:
+            del namespace['__lazy_loader__']
+            loader.exec_module(self)
+        return types.ModuleType.__getattribute__(self, attr)
+
+
+class LazyOpenatLoader(Loader):
+    """Wraps a source or bytecode loader so that its modules' code
+    runs only when they're first used, for Pythons without
+    importlib.util.LazyLoader."""
+
+    def __init__(self, loader):
+        self.loader = loader
+
+    def create_module(self, spec):
+        return _LazyModule(spec.name)
+
+    def exec_module(self, module):
+        module.__dict__['__lazy_loader__'] = self.loader
+
+
+# new in 3.5
+_LazyLoader = getattr(importlib.util, 'LazyLoader', LazyOpenatLoader)
+
 
 class _OpenatGetMixin(SourceLoader):
+    _view_bytecode = False
+
     def path_stats(self, path):
         stats = self.dirobj.stat(path)
         return {'mtime': stats.st_mtime, 'size': stats.st_size}
 
     def get_data(self, path):
-        with self.dirobj.open(path, 'rb') as f:
-            return f.read()
+        data = PREFETCHED.take(path)
+        if data is not None:
+            STATS.bytes_read += len(data)
+            return data
+        if self._view_bytecode and path.endswith(_BYTECODE_SUFFIXES):
+            return self.get_data_view(path)
+        with TRACER.span('read', self.name):
+            with self.dirobj.open(path, 'rb') as f:
+                data = f.read()
+            STATS.bytes_read += len(data)
+            TRACER.read(len(data))
+            return data
+
+    def get_data_view(self, path):
+        """Like get_data, but return a memoryview that, for large
+        files, is backed by a read only mapping of the file."""
+        with TRACER.span('read', self.name):
+            with self.dirobj.open(path, 'rb') as f:
+                data = map_or_read(f, MMAP_THRESHOLD)
+            STATS.bytes_read += len(data)
+            TRACER.read(len(data))
+            return data
 
     def get_filename(self, path):
         return self.path
@@ -44,55 +157,68 @@ class OpenatSourceFileLoader(OpenatLoader, _OpenatGetMixin):
 
 class OpenatSourcelessFileLoader(OpenatLoader, SourcelessFileLoader,
                                  _OpenatGetMixin):
+    # SourcelessFileLoader's would open the file by its path
+    get_data = _OpenatGetMixin.get_data
 
     def get_source(self, fullname):
         return None
 
 
+def _load_extension(fullname, so_fd, path):
+    """fdlopen the extension module open on so_fd and initialize it as
+    fullname, with path as its __file__."""
+    name = fullname.encode('ascii')
+    _, _, shortname = fullname.rpartition('.')
+    shortname = shortname.encode('ascii')
+    gc.disable()
+    try:
+        loaded_so = fdlopen(so_fd, RTLD_NOW)
+        initmodule_pointer = dlsym(loaded_so, b'PyInit_' + shortname)
+        initmodule = callable_with_gil(initmodule_pointer)
+
+        with _Py_PackageContext(name,
+                                shortname):
+            m = initmodule()
+
+        m_ptr = ctypes.py_object(m)
+        name_ptr = ctypes.py_object(name)
+        # ffft
+        path_ascii = os.fsencode(path)
+        path_ptr = ctypes.py_object(path_ascii)
+
+        res = ctypes.pythonapi._PyImport_FixupExtensionObject(m_ptr,
+                                                              name_ptr,
+                                                              path_ptr)
+        if res < 0:
+            raise ImportError("_PyImport_FixupExtensionObject failed")
+
+        m.__file__ = path
+        STATS.extensions_loaded += 1
+        return m
+    finally:
+        gc.enable()
+
+
 class OpenatExtensionFileLoader(OpenatLoader, _OpenatGetMixin,
                                 ExtensionFileLoader):
 
     def create_module(self, spec):
-        fullname = spec.name.encode('ascii')
-        _, _, shortname = spec.name.rpartition('.')
-        shortname = shortname.encode('ascii')
-        gc.disable()
-        try:
-            with self.dirobj.open(self.path) as so:
-                so_fd = so.fileno()
-                loaded_so = fdlopen(so_fd, RTLD_NOW)
-                initmodule_pointer = dlsym(loaded_so, b'PyInit_' + shortname)
-                initmodule = callable_with_gil(initmodule_pointer)
-
-                with _Py_PackageContext(fullname,
-                                        shortname):
-                    m = initmodule()
-
-                m_ptr = ctypes.py_object(m)
-                name_ptr = ctypes.py_object(fullname)
-                # ffft
-                path_ascii = os.fsencode(self.path)
-                path_ptr = ctypes.py_object(path_ascii)
-
-                res = ctypes.pythonapi._PyImport_FixupExtensionObject(m_ptr,
-                                                                      name_ptr,
-                                                                      path_ptr)
-                if res < 0:
-                    raise ImportError("_PyImport_FixupExtensionObject failed")
-
-                m.__file__ = self.path
-                return m
-        finally:
-            gc.enable()
+        with TRACER.span('exec', spec.name), \
+                self.dirobj.open(self.path) as so:
+            return _load_extension(spec.name, so.fileno(), self.path)
 
     def exec_module(self, module):
         return module
 
+    def warm(self, fullname):
+        pass
+
 
 class OpenatFileFinder(BaseOpenatFileFinder, MetaPathFinder):
 
-    def __init__(self, path, rights):
-        super().__init__(path, rights)
+    def __init__(self, path, rights,
+                 max_dirfds=BaseOpenatFileFinder.MAX_DIRFDS, lazy=None):
+        super().__init__(path, rights, max_dirfds, lazy)
 
         loaders = [(OpenatExtensionFileLoader, _imp.extension_suffixes()),
                    (OpenatSourceFileLoader, SOURCE_SUFFIXES),
@@ -101,13 +227,45 @@ class OpenatFileFinder(BaseOpenatFileFinder, MetaPathFinder):
                          for loader, suffixes in loaders
                          for suffix in suffixes]
 
+    def suffixes(self):
+        return [suffix for suffix, _ in self._loaders]
+
     def find_spec(self, fullname, path=None, target=None):
         """Try to find a loader for the specified module, or the namespace
         package portions. Returns (loader, list-of-portions)."""
         builtin_spec = BuiltinImporter.find_spec(fullname, path, target)
         if builtin_spec:
             return builtin_spec
+        return self._find_spec(fullname, path)
+
+    def _find_spec(self, fullname, path=None):
+        self.lookups += 1
+        with TRACER.span('find', fullname, finder=self.path) as span:
+            key = self._miss_key(fullname, path)
+            if key in self._misses:
+                self.misses += 1
+                span.note(found=False, cached=True)
+                return None
+            spec = self._search(fullname, path)
+            if spec is None:
+                self.misses += 1
+                self._misses.add(key)
+            else:
+                self.hits += 1
+                self._make_lazy(spec)
+            span.note(found=spec is not None)
+            return spec
 
+    def _make_lazy(self, spec):
+        # extension modules initialize in create_module, so they
+        # can't be deferred
+        if (self.lazy is not None and
+                isinstance(spec.loader, OpenatLoader) and
+                not isinstance(spec.loader, OpenatExtensionFileLoader) and
+                self.lazy(spec.name)):
+            spec.loader = _LazyLoader(spec.loader)
+
+    def _search(self, fullname, path):
         is_namespace = False
         parts = fullname.split('.')
         tail_module = parts[-1]
@@ -146,3 +304,223 @@ class OpenatFileFinder(BaseOpenatFileFinder, MetaPathFinder):
                 spec.submodule_search_locations = [base_path]
                 return spec
         return None
+
+
+class OpenatPathEntryFinder(object):
+    """A path entry finder for sys.path_hooks that searches a
+    directory beneath an OpenatFileFinder's through its descriptors.
+    Builtin modules are left to BuiltinImporter."""
+
+    def __init__(self, finder, path):
+        self.finder = finder
+        self.path = path
+        self._search_path = None if path == finder.path else [path]
+
+    def find_spec(self, fullname, target=None):
+        return self.finder._find_spec(fullname, self._search_path)
+
+    def invalidate_caches(self):
+        self.finder.invalidate_caches()
+
+    def __repr__(self):
+        return '<{} for {}>'.format(self.__class__.__name__, self.path)
+
+
+# what sys.meta_path holds when imports are left to sys.path_hooks
+BASE_META_PATH = [BuiltinImporter, FrozenImporter, PathFinder]
+
+
+class OpenatZipFinder(OpenatFileFinder):
+    """Finds modules in a zip archive on sys.path, or a directory
+    within one, through a ZipDirectory.  Like zipimport, it doesn't
+    look for extension modules."""
+    DIRECTORY = ZipDirectory
+
+    def __init__(self, path, rights,
+                 max_dirfds=BaseOpenatFileFinder.MAX_DIRFDS, lazy=None):
+        super().__init__(path, rights, max_dirfds, lazy)
+        self._loaders = [(suffix, loader)
+                         for suffix, loader in self._loaders
+                         if loader is not OpenatExtensionFileLoader]
+
+
+class IndexedOpenatFileFinder(MetaPathFinder):
+    """A single meta path finder that dispatches to the
+    OpenatFileFinder for the sys.path entry that contains a module,
+    found through a ModuleIndex."""
+
+    def __init__(self, finders):
+        self.index = ModuleIndex(finders)
+
+    def find_spec(self, fullname, path=None, target=None):
+        builtin_spec = BuiltinImporter.find_spec(fullname, path, target)
+        if builtin_spec:
+            return builtin_spec
+
+        for finder in self.index.finders_for(fullname, path):
+            spec = finder._find_spec(fullname, path)
+            if spec is not None:
+                return spec
+        return None
+
+    def invalidate_caches(self):
+        for finder in self.index.finders:
+            finder.invalidate_caches()
+        self.index.rebuild()
+
+
+class OpenatImageLoader(InspectLoader):
+
+    def __init__(self, image, fullname):
+        self.image = image
+        self.name = fullname
+        self.path = image.path(fullname)
+
+    def is_package(self, fullname):
+        return self.image.get(fullname).is_package
+
+    def get_code(self, fullname):
+        STATS.code_unmarshalled += 1
+        return self.image.code(fullname)
+
+    def get_source(self, fullname):
+        source = self.image.source(fullname)
+        return source and decode_source(source)
+
+    def get_filename(self, fullname):
+        return self.path
+
+    def exec_module(self, module):
+        with TRACER.span('exec', module.__name__):
+            super().exec_module(module)
+
+
+class OpenatImageExtensionLoader(OpenatImageLoader):
+
+    def get_code(self, fullname):
+        return None
+
+    def get_source(self, fullname):
+        return None
+
+    def create_module(self, spec):
+        with TRACER.span('exec', spec.name):
+            return _load_extension(spec.name,
+                                   self.image.extension_fd(spec.name),
+                                   self.path)
+
+    def exec_module(self, module):
+        return module
+
+
+class OpenatImageFinder(MetaPathFinder):
+    """Finds modules in a pepperbox.image.Image, without touching the
+    file system.  Its extension modules are copied into memory when
+    the finder's created, to be loaded from there: by the time they're
+    imported, restrict() has set RLIMIT_FSIZE to 0, which forbids
+    writing the copies."""
+
+    def __init__(self, image):
+        self.image = image
+        image.open_extensions()
+
+    def find_spec(self, fullname, path=None, target=None):
+        entry = self.image.get(fullname)
+        if entry is None:
+            return None
+        if entry.kind == EXTENSION:
+            loader = OpenatImageExtensionLoader(self.image, fullname)
+        else:
+            loader = OpenatImageLoader(self.image, fullname)
+        locations = None
+        if entry.is_package:
+            locations = [os.path.join(self.image.name, *fullname.split('.'))]
+        return spec_from_file_location(fullname, loader.path,
+                                       loader=loader,
+                                       submodule_search_locations=locations)
+
+
+def locate(fullname, path=None):
+    """Find fullname with the finders on sys.meta_path without
+    importing it.  Returns its loader and submodule search locations,
+    or (None, None)."""
+    for finder in sys.meta_path:
+        find_spec = getattr(finder, 'find_spec', None)
+        if find_spec is None:
+            continue
+        spec = find_spec(fullname, path)
+        if spec is not None:
+            loader = spec.loader
+            if isinstance(loader, _LazyLoader):
+                loader = loader.loader
+            return loader, spec.submodule_search_locations
+    return None, None
+
+
+def prefetch_paths(loader):
+    """Return the files, as (dirobj, path) pairs, that loader's
+    get_data will be asked for: a source module's bytecode if it's
+    been cached, or else its source."""
+    if isinstance(loader, OpenatSourceFileLoader):
+        try:
+            bytecode = cache_from_source(loader.path)
+        except NotImplementedError:
+            bytecode = None
+        if bytecode is not None and loader.dirobj.isfile(bytecode):
+            return [(loader.dirobj, bytecode)]
+        return [(loader.dirobj, loader.path)]
+    if isinstance(loader, OpenatSourcelessFileLoader):
+        return [(loader.dirobj, loader.path)]
+    return []
+
+
+def _stale(source, bytecode):
+    """Whether importlib would reject bytecode for source: the source
+    mtime and size its header records must match the source's own.
+    The bytecode file's own mtime says nothing about that."""
+    try:
+        st = os.stat(source)
+        with open(bytecode, 'rb') as f:
+            header = f.read(16)
+    except OSError:
+        return True
+    if header[:4] != importlib.util.MAGIC_NUMBER:
+        return True
+    if sys.version_info >= (3, 7):
+        # PEP 552's flags precede the mtime and size
+        (flags,) = struct.unpack('<I', header[4:8])
+        if flags & 0b1:
+            # hash based; unchecked bytecode is never stale
+            return bool(flags & 0b10) and (
+                header[8:16] != _source_hash(source))
+        header = header[:4] + header[8:]
+    if len(header) < 12:
+        return True
+    return struct.unpack('<II', header[4:12]) != (
+        int(st.st_mtime) & 0xFFFFFFFF, st.st_size & 0xFFFFFFFF)
+
+
+def _source_hash(source):
+    try:
+        with open(source, 'rb') as f:
+            return importlib.util.source_hash(f.read())
+    except OSError:
+        return None
+
+
+def stale_source(fullname, path=None):
+    """Find fullname with the standard path finder, without importing
+    it.  Returns the path of its source if that has no up to date
+    bytecode, or else None, and its submodule search locations."""
+    spec = PathFinder.find_spec(fullname, path)
+    if spec is None:
+        return None, None
+    source = None
+    if isinstance(spec.loader, SourceFileLoader):
+        try:
+            bytecode = cache_from_source(spec.origin)
+        except NotImplementedError:
+            bytecode = None
+        if bytecode is not None and _stale(spec.origin, bytecode):
+            source = spec.origin
+    return source, spec.submodule_search_locations
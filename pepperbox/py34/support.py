@@ -1,7 +1,25 @@
+import io
 import os
+import mmap
+import stat
 import ctypes
 
 
+# os.scandir only accepts a file descriptor as of Python 3.7
+_SCANDIR_FD = getattr(os, 'scandir', None) in getattr(os, 'supports_fd', ())
+
+
+def _entry_kind(entry):
+    # symlinks have to be followed with a stat; leave them unresolved
+    if entry.is_symlink():
+        return None
+    if entry.is_dir(follow_symlinks=False):
+        return stat.S_IFDIR
+    if entry.is_file(follow_symlinks=False):
+        return stat.S_IFREG
+    return 0
+
+
 class _DirectoryFD:
     opened = False
 
@@ -29,6 +47,12 @@ class _DirectoryFD:
     def listdir(self):
         return os.listdir(self._dir_fd)
 
+    def scandir(self):
+        if not _SCANDIR_FD:
+            return [(name, None) for name in self.listdir()]
+        with os.scandir(self._dir_fd) as entries:
+            return [(entry.name, _entry_kind(entry)) for entry in entries]
+
     @property
     def closed(self):
         return not self.opened
@@ -49,4 +73,21 @@ def fdopendir(fd, path):
     return fd_for_dir(path, fd)
 
 
+def map_or_read(f, threshold, offset=0):
+    """Return a memoryview of f's contents from offset on.  Files of
+    at least threshold bytes are mapped rather than copied into
+    memory."""
+    try:
+        size = os.fstat(f.fileno()).st_size
+    except io.UnsupportedOperation:
+        # already in memory, e.g. a member of a zip archive
+        size = None
+    if size is not None and size >= threshold:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    else:
+        f.seek(0)
+        data = f.read()
+    return memoryview(data)[offset:]
+
+
 INITMODULEFUNC = ctypes.PYFUNCTYPE(ctypes.py_object)
@@ -1,9 +1,7 @@
-def restrict():
-    import resource
-    import termios
+def default_rights():
     import spyce
     import sys
-    import pepperbox.loader
+    import termios
 
     rights = [spyce.Rights([spyce.CAP_READ,
                             spyce.CAP_LOOKUP,
@@ -16,6 +14,15 @@ def restrict():
                             spyce.CAP_FSTATFS])]
     if sys.version_info.major > 2:
         rights.append(spyce.IoctlRights([termios.FIOCLEX]))
+    return rights
+
+
+# the resident set size restrict() limits the sandboxed process to
+RSS_LIMIT = 10 * 1024 * 1024
+
+
+def limit_resources():
+    import resource
 
     def limitResource(thing, soft, hard=None):
         hard = hard or soft
@@ -24,12 +31,64 @@ def restrict():
     limitResource(resource.RLIMIT_CPU, 9, 11)
     limitResource(resource.RLIMIT_AS, 512 * 1024 * 1024)
     limitResource(resource.RLIMIT_DATA, 512 * 1024 * 1024)
-    limitResource(resource.RLIMIT_RSS, 10 * 1024 * 1024)
+    limitResource(resource.RLIMIT_RSS, RSS_LIMIT)
     limitResource(resource.RLIMIT_CORE, 0)
     limitResource(resource.RLIMIT_FSIZE, 0)
     limitResource(resource.RLIMIT_MEMLOCK, 0)
     limitResource(resource.RLIMIT_NPROC, 0)
 
+
+def restrict(preimports=('random',), telemetry_fd=None, profile=None,
+             telemetry_trace=False, **install_kwargs):
+    """Install pepperbox's finders, limit resources and enter
+    capability mode.
+
+    :param telemetry_fd: an open pipe or socket to send telemetry
+    records over; see pepperbox.telemetry.  Its import statistics and
+    resource usage are sent when the process exits, as is the import
+    profile if install's record argument is true.
+
+    :param profile: if given, sample the stack every profile seconds
+    of CPU time and send the folded stacks over the telemetry channel
+    at exit, or when RLIMIT_CPU's soft limit is reached.  Requires
+    telemetry_fd.
+
+    :param telemetry_trace: send pepperbox.trace's events over the
+    telemetry channel, in place of install's trace argument or
+    PEPPERBOX_TRACE.  Requires telemetry_fd.
+
+    A trace sink named by PEPPERBOX_TRACE must be a pipe or socket,
+    since RLIMIT_FSIZE forbids writing to regular files.
+    """
+    if profile is not None and telemetry_fd is None:
+        raise ValueError('profile requires telemetry_fd')
+    if install_kwargs.get('record') and telemetry_fd is None:
+        raise ValueError('record requires telemetry_fd')
+    if telemetry_trace and telemetry_fd is None:
+        raise ValueError('telemetry_trace requires telemetry_fd')
+    if not telemetry_trace and install_kwargs.get('trace') is None:
+        import pepperbox.trace
+        install_kwargs['trace'] = pepperbox.trace.sink_from_environment(
+            regular_files=False)
+
+    import spyce
+    import pepperbox.loader
+
+    rights = default_rights()
+
+    if telemetry_fd is not None:
+        import pepperbox.telemetry
+        channel = pepperbox.telemetry.open_channel(telemetry_fd)
+        if telemetry_trace:
+            install_kwargs['trace'] = channel.trace
+
     pepperbox.loader.install(rights=rights,
-                             preimports=('random',))
+                             preimports=preimports,
+                             **install_kwargs)
+    # after install, whose parallel preimports and prefetching need
+    # threads and processes that RLIMIT_NPROC would forbid
+    limit_resources()
+    if profile is not None:
+        import pepperbox.profile
+        pepperbox.profile.start(channel, profile)
     spyce.enterCapabilityMode()
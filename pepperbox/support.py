@@ -1,7 +1,17 @@
+import collections
 import ctypes
+import errno
+import heapq
+import io
 import os
+import posixpath
 import stat
 import sys
+import threading
+import time
+import zipfile
+
+from .trace import TRACER
 
 
 def generate_py_tag():
@@ -36,6 +46,35 @@ else:
     from .py27 import support
 
 
+# files at least this large are mapped instead of read
+MMAP_THRESHOLD = 64 * 1024
+
+
+class Stats(object):
+    """Counters cheap enough to always keep: each is an integer
+    attribute incremented in place."""
+
+    FIELDS = ('dirfds_opened', 'dirfds_closed', 'bytes_read',
+              'code_compiled', 'code_unmarshalled', 'code_cached',
+              'extensions_loaded')
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        for field in self.FIELDS:
+            setattr(self, field, 0)
+
+    def as_dict(self):
+        counters = dict((field, getattr(self, field))
+                        for field in self.FIELDS)
+        counters['dirfds_held'] = self.dirfds_opened - self.dirfds_closed
+        return counters
+
+
+STATS = Stats()
+
+
 class BadPath(Exception):
     pass
 
@@ -44,26 +83,65 @@ class BadMode(Exception):
     pass
 
 
+def _relative_to(name, path):
+    path = os.path.normpath(path)
+    if not os.path.isabs(path):
+        return path
+
+    if not path.startswith(name):
+        raise BadPath("path {} not a child of {}".format(path, name))
+    path = path.replace(name, '')
+    if os.path.isabs(path):
+        path = path[1:]
+
+    return path or '.'
+
+
 class DirectoryFD(object):
 
-    def __init__(self, path, dirobj=None):
+    def __init__(self, path, dirobj=None, parent=None):
         self.name = path
-        self._dirobj = dirobj or support.opendir(path)
-        self.fileno = self._dirobj.fileno
-
-    def handle_abspath(self, path):
-        path = os.path.normpath(path)
-        if not os.path.isabs(path):
-            return path
+        self._opened = dirobj or support.opendir(path)
+        STATS.dirfds_opened += 1
+        self._parent = parent
+        self._released = False
+        # called whenever a released descriptor is reopened
+        self.on_reopen = None
+        # directory listings are shared by every DirectoryFD opened
+        # beneath the same root, keyed by their path relative to it,
+        # as is the lock that keeps one thread from releasing a
+        # descriptor while another is using it
+        if parent is None:
+            self._root, self._prefix = self, os.curdir
+            self._listings = {}
+            self._seeds = {}
+            self._lock = threading.RLock()
+        else:
+            parent_dirobj, relpath = parent
+            self._root = parent_dirobj._root
+            self._prefix = os.path.normpath(
+                os.path.join(parent_dirobj._prefix, relpath))
+            self._lock = self._root._lock
 
-        if not path.startswith(self.name):
-            raise BadPath("path {} not a child of {}".format(path,
-                                                             self.name))
-        path = path.replace(self.name, '')
-        if os.path.isabs(path):
-            path = path[1:]
+    @property
+    def _dirobj(self):
+        if self._released:
+            parent_dirobj, relpath = self._parent
+            TRACER.syscall('openat')
+            self._opened = support.fdopendir(parent_dirobj.fileno(),
+                                             relpath)
+            STATS.dirfds_opened += 1
+            self._released = False
+            if self.on_reopen is not None:
+                self.on_reopen()
+        return self._opened
+
+    def fileno(self):
+        with self._lock:
+            return self._dirobj.fileno()
 
-        return path or '.'
+    def handle_abspath(self, path):
+        return _relative_to(self.name, path)
 
     def open(self, path, mode='rb'):
         bad = set('wa+') & set(mode)
@@ -71,17 +149,24 @@ class DirectoryFD(object):
             raise BadMode('invalid mode components {!r}'.format(bad))
 
         path = self.handle_abspath(path)
-        return self._dirobj.open(path, mode)
+        TRACER.syscall('openat')
+        with self._lock:
+            return self._dirobj.open(path, mode)
 
     def opendir(self, path):
         path = self.handle_abspath(path)
-        return DirectoryFD(os.path.join(self.name, path),
-                           support.fdopendir(self._dirobj.fileno(),
-                                             path))
+        TRACER.syscall('openat')
+        with self._lock:
+            return DirectoryFD(
+                os.path.normpath(os.path.join(self.name, path)),
+                support.fdopendir(self._dirobj.fileno(), path),
+                parent=(self, path))
 
     def stat(self, path):
         path = self.handle_abspath(path)
-        return self._dirobj.stat(path)
+        TRACER.syscall('fstatat')
+        with self._lock:
+            return self._dirobj.stat(path)
 
     def _quiet_stat(self, path):
         try:
@@ -89,22 +174,143 @@ class DirectoryFD(object):
         except (OSError, BadPath):
             return None
 
+    def _listing(self, relpath):
+        """Return a dict mapping the names in the directory at relpath
+        to their stat.S_IFMT type.  Each directory is read once, with
+        a single listing of its descriptor; types the listing couldn't
+        report (symlinks, or filesystems without d_type) are None
+        until _kind resolves them.
+        """
+        key = os.path.normpath(os.path.join(self._prefix, relpath))
+        listings = self._root._listings
+        listing = listings.get(key)
+        if listing is not None:
+            return listing
+
+        listing = self._seeded_listing(key, relpath)
+        if listing is None:
+            TRACER.syscall('getdirentries')
+            # even the current directory is listed through a fresh
+            # descriptor: scanning our own would move the offset it
+            # shares with every process forked since it was opened
+            TRACER.syscall('openat')
+            with self._lock:
+                dirobj = support.fdopendir(self._dirobj.fileno(), relpath)
+            STATS.dirfds_opened += 1
+            try:
+                listing = dict(dirobj.scandir())
+            finally:
+                dirobj.close()
+                STATS.dirfds_closed += 1
+        listings[key] = listing
+        return listing
+
+    def _seeded_listing(self, key, relpath):
+        seed = self._root._seeds.pop(key, None)
+        if seed is None:
+            return None
+        dev, ino, mtime, entries = seed
+        st = self._quiet_stat(relpath)
+        if st is None or (st.st_dev, st.st_ino, st.st_mtime) != (dev, ino,
+                                                                 mtime):
+            return None
+        return dict((name, entry[0]) for name, entry in entries.items())
+
+    def seed(self, listings):
+        """Provide listings read ahead of time, e.g. from a manifest
+        written by pepperbox.index.
+
+        :param listings: a dict mapping directory paths relative to
+        this one to (st_dev, st_ino, st_mtime, entries) tuples, where
+        entries maps each name in the directory to a sequence
+        starting with its stat.S_IFMT type.  A listing is only used
+        if its directory's stat still matches when it's first needed.
+        """
+        for relpath, seed in listings.items():
+            key = os.path.normpath(os.path.join(self._prefix, relpath))
+            self._root._seeds[key] = seed
+
+    def _kind(self, path):
+        """Return path's stat.S_IFMT type, or None if it doesn't exist.
+
+        Lookups are answered from directory listings instead of a
+        stat per path, so misses cost no system calls at all.
+        """
+        try:
+            path = self.handle_abspath(path)
+        except BadPath:
+            return None
+        if path == os.curdir:
+            return stat.S_IFDIR
+
+        parts = path.split(os.sep)
+        if os.pardir in parts:
+            st = self._quiet_stat(path)
+            return st and stat.S_IFMT(st.st_mode)
+
+        parent = os.curdir
+        for i, name in enumerate(parts):
+            try:
+                listing = self._listing(parent)
+            except OSError:
+                # unreadable but searchable directories can still be
+                # stat'd through
+                st = self._quiet_stat(path)
+                return st and stat.S_IFMT(st.st_mode)
+
+            relpath = os.path.join(parent, name)
+            kind = listing.get(name, False)
+            if kind is False:
+                return None
+            elif kind is None:
+                st = self._quiet_stat(relpath)
+                if st is None:
+                    del listing[name]
+                    return None
+                kind = listing[name] = stat.S_IFMT(st.st_mode)
+
+            if i < len(parts) - 1 and kind != stat.S_IFDIR:
+                return None
+            parent = relpath
+        return kind
+
     def exists(self, path):
-        return bool(self._quiet_stat(path))
+        return self._kind(path) is not None
 
     def isfile(self, path):
-        st = self._quiet_stat(path)
-        return st and stat.S_ISREG(st.st_mode)
+        return self._kind(path) == stat.S_IFREG
 
     def isdir(self, path):
-        st = self._quiet_stat(path)
-        return st and stat.S_ISDIR(st.st_mode)
+        return self._kind(path) == stat.S_IFDIR
+
+    def invalidate(self):
+        """Forget every directory listing read beneath this
+        directory's root."""
+        self._root._listings.clear()
+        self._root._seeds.clear()
 
     def listdir(self):
-        return self._dirobj.listdir()
+        with self._lock:
+            return self._dirobj.listdir()
 
     def close(self):
-        self._dirobj.close()
+        with self._lock:
+            self._released = False
+            if not self._opened.closed:
+                self._opened.close()
+                STATS.dirfds_closed += 1
+
+    def release(self):
+        """Close the descriptor of a directory opened with opendir,
+        keeping enough to reopen it through its parent if it's used
+        again."""
+        if self._parent is None:
+            raise ValueError('only subdirectories can be released')
+        with self._lock:
+            if not self._opened.closed:
+                self._opened.close()
+                STATS.dirfds_closed += 1
+                self._released = True
 
     def __enter__(self):
         return self
@@ -114,7 +320,271 @@ class DirectoryFD(object):
 
     @property
     def closed(self):
-        return self._dirobj.closed
+        return self._opened.closed
+
+
+def split_zip_path(path):
+    """Return (archive, inner) if path names a zip archive, or a
+    directory inside one, where inner is the directory's path within
+    the archive; otherwise return None."""
+    archive, inner = os.path.normpath(path), ''
+    while not os.path.isfile(archive):
+        archive, tail = os.path.split(archive)
+        if not tail:
+            return None
+        inner = posixpath.join(tail, inner) if inner else tail
+    if not zipfile.is_zipfile(archive):
+        return None
+    return archive, inner
+
+
+class ZipDirectory(object):
+    """A zip archive, or a directory within one, that can stand in
+    for a DirectoryFD.
+
+    The archive is opened once and its central directory read into
+    an index of its members, so looking a path up costs no system
+    calls.  Members are read by seeking within the archive's
+    descriptor and are returned as in-memory files.
+
+    :param path: the archive's path, optionally followed by a
+    directory within it, as it appears on sys.path.
+    """
+
+    def __init__(self, path, parent=None, prefix=None):
+        self.name = os.path.normpath(path)
+        # the archive and its index are shared by every ZipDirectory
+        # opened beneath the one that read them
+        if parent is not None:
+            self._root = parent._root
+            self._prefix = prefix
+            return
+
+        self._root = self
+        archive, self._prefix = split_zip_path(path)
+        f = open(archive, 'rb')
+        try:
+            zipobj = zipfile.ZipFile(f)
+        except Exception:
+            f.close()
+            raise
+        self._file, self._zipobj = f, zipobj
+        self._st = os.fstat(f.fileno())
+        self._lock = threading.RLock()
+        self._members = members = {}
+        self._kinds = kinds = {'': stat.S_IFDIR}
+        for info in zipobj.infolist():
+            name = info.filename.rstrip('/')
+            if not info.filename.endswith('/'):
+                members[name] = info
+                kinds[name] = stat.S_IFREG
+            # parent directories needn't have entries of their own
+            while name:
+                name = posixpath.dirname(name)
+                kinds.setdefault(name, stat.S_IFDIR)
+
+    def _key(self, path):
+        relpath = _relative_to(self.name, path).replace(os.sep, '/')
+        key = posixpath.normpath(posixpath.join(self._prefix, relpath))
+        if key == posixpath.curdir:
+            return ''
+        if key == posixpath.pardir or key.startswith('../'):
+            raise BadPath('path {} is outside {}'.format(path, self.name))
+        return key
+
+    def _missing(self, path):
+        return OSError(errno.ENOENT, os.strerror(errno.ENOENT), path)
+
+    def fileno(self):
+        return self._root._file.fileno()
+
+    def handle_abspath(self, path):
+        return _relative_to(self.name, path)
+
+    def open(self, path, mode='rb'):
+        bad = set('wa+') & set(mode)
+        if bad:
+            raise BadMode('invalid mode components {!r}'.format(bad))
+
+        info = self._root._members.get(self._key(path))
+        if info is None:
+            raise self._missing(path)
+        with self._root._lock:
+            data = self._root._zipobj.read(info)
+        if 'b' in mode:
+            return io.BytesIO(data)
+        return io.TextIOWrapper(io.BytesIO(data))
+
+    def opendir(self, path):
+        key = self._key(path)
+        if self._root._kinds.get(key) != stat.S_IFDIR:
+            raise self._missing(path)
+        return ZipDirectory(os.path.join(self.name, self.handle_abspath(path)),
+                            parent=self, prefix=key)
+
+    def stat(self, path):
+        key = self._key(path)
+        kind = self._root._kinds.get(key)
+        if kind is None:
+            raise self._missing(path)
+        archive_st = self._root._st
+        info = self._root._members.get(key)
+        if info is None:
+            return os.stat_result((kind | 0o555, 0, archive_st.st_dev, 1,
+                                   0, 0, 0, archive_st.st_mtime,
+                                   archive_st.st_mtime, archive_st.st_mtime))
+        mtime = time.mktime(info.date_time + (0, 0, -1))
+        # members' inode numbers are negative, so they never collide
+        # with those of real files on the archive's device
+        return os.stat_result((kind | 0o444, -1 - info.header_offset,
+                               archive_st.st_dev, 1, 0, 0, info.file_size,
+                               mtime, mtime, mtime))
+
+    def _listing(self, relpath):
+        prefix = self._key(relpath)
+        return dict((posixpath.basename(key), kind)
+                    for key, kind in self._root._kinds.items()
+                    if key and posixpath.dirname(key) == prefix)
+
+    def _kind(self, path):
+        try:
+            return self._root._kinds.get(self._key(path))
+        except BadPath:
+            return None
+
+    def exists(self, path):
+        return self._kind(path) is not None
+
+    def isfile(self, path):
+        return self._kind(path) == stat.S_IFREG
+
+    def isdir(self, path):
+        return self._kind(path) == stat.S_IFDIR
+
+    def invalidate(self):
+        pass
+
+    def seed(self, listings):
+        pass
+
+    def listdir(self):
+        return list(self._listing(os.curdir))
+
+    def close(self):
+        """Close the archive, if this is the ZipDirectory that opened
+        it."""
+        if self._root is self:
+            self._zipobj.close()
+            self._file.close()
+
+    def release(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def closed(self):
+        return self._root._file.closed
+
+
+class CodeCache(object):
+    """Code objects compiled before the sandbox was entered, keyed by
+    the (st_dev, st_ino, st_mtime, st_size) of the file they were
+    compiled from, so a changed file is never served stale code.
+    """
+
+    def __init__(self):
+        self._code = {}
+
+    def __len__(self):
+        return len(self._code)
+
+    @staticmethod
+    def key(st):
+        return st.st_dev, st.st_ino, st.st_mtime, st.st_size
+
+    def get(self, dirobj, path):
+        if not self._code:
+            return None
+        try:
+            st = dirobj.stat(path)
+        except (OSError, BadPath):
+            return None
+        return self._code.get(self.key(st))
+
+    def put(self, dirobj, path, code):
+        self._code[self.key(dirobj.stat(path))] = code
+
+    def clear(self):
+        self._code.clear()
+
+
+CODE_CACHE = CodeCache()
+
+
+class PrefetchCache(object):
+    """File contents read ahead of time by pepperbox.prefetch, keyed
+    by the path the loader will read.  Each is taken by the first
+    read.
+
+    Files are put in the order their modules are expected to be
+    imported.  Taking one evicts any put before it that haven't been
+    taken, as their imports have either gone another way or won't
+    happen, so unused contents aren't held for the life of the
+    process.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._contents = {}
+        self._order = []
+        self._taken = -1
+
+    def __len__(self):
+        return len(self._contents)
+
+    def __contains__(self, path):
+        return path in self._contents
+
+    def put(self, path, order, data):
+        """Hold data for path, which is order'th in the expected
+        import order.  Returns False, holding nothing, if a file
+        later in the order has already been taken."""
+        with self._lock:
+            if order < self._taken:
+                return False
+            self._contents[path] = (order, data)
+            heapq.heappush(self._order, (order, path))
+        return True
+
+    def take(self, path):
+        """Return and forget path's contents, or None if they're not
+        held."""
+        with self._lock:
+            entry = self._contents.pop(path, None)
+            if entry is None:
+                return None
+            order, data = entry
+            self._taken = max(self._taken, order)
+            while self._order and self._order[0][0] < self._taken:
+                evicted_order, evicted = heapq.heappop(self._order)
+                held = self._contents.get(evicted)
+                if held is not None and held[0] == evicted_order:
+                    del self._contents[evicted]
+        return data
+
+    def clear(self):
+        with self._lock:
+            self._contents.clear()
+            del self._order[:]
+            self._taken = -1
+
+
+PREFETCHED = PrefetchCache()
 
 
 class _Py_PackageContext(object):
@@ -158,23 +628,178 @@ class _Py_PackageContext(object):
         self._Py_PackageContext.value = self.oldpackagecontext
 
 
+class LazyPolicy(object):
+    """Decides which modules are loaded lazily, by name.  A prefix
+    matches a module and every module beneath it.
+
+    :param allow: the prefixes of the modules to load lazily, or None
+    for every module.
+
+    :param deny: the prefixes of modules always loaded eagerly, even
+    if allowed.
+    """
+
+    def __init__(self, allow=None, deny=()):
+        self.allow = None if allow is None else tuple(allow)
+        self.deny = tuple(deny)
+
+    @staticmethod
+    def _matches(fullname, prefixes):
+        return any(fullname == prefix or fullname.startswith(prefix + '.')
+                   for prefix in prefixes)
+
+    def __call__(self, fullname):
+        if self._matches(fullname, self.deny):
+            return False
+        return self.allow is None or self._matches(fullname, self.allow)
+
+
 class BaseOpenatFileFinder(object):
+    MAX_DIRFDS = 64
+    # what the sys.path entry is opened as
+    DIRECTORY = DirectoryFD
 
-    def __init__(self, path, rights):
+    def __init__(self, path, rights, max_dirfds=MAX_DIRFDS, lazy=None):
         self.path = path
-        self.dirobj = DirectoryFD(path)
+        self.dirobj = self.DIRECTORY(path)
         for rightsObj in rights:
             rightsObj.limitFile(self.dirobj)
+        # package directories, opened at most once apiece.  no more
+        # than max_dirfds of them hold a descriptor at a time; the
+        # least recently used are released and reopen on demand.
+        self.max_dirfds = max_dirfds
+        self._subdirs = {}
+        self._open_subdirs = collections.OrderedDict()
+        # the directory's own lock, so that releasing a descriptor
+        # waits for any thread using it
+        self._lock = self.dirobj._root._lock
+        # (fullname, path) pairs that weren't found.  directories
+        # can't change beneath a sandboxed process, so a miss is
+        # final until invalidate_caches is called.
+        self._misses = set()
+        self.lookups = self.hits = self.misses = 0
+        # a LazyPolicy, or None to load every module eagerly
+        self.lazy = lazy
+
+    def suffixes(self):  # pragma: no cover
+        raise NotImplementedError
+
+    def _miss_key(self, fullname, path):
+        return fullname, tuple(path) if path else None
+
+    def stats(self):
+        return {'path': self.path,
+                'lookups': self.lookups,
+                'hits': self.hits,
+                'misses': self.misses}
+
+    def invalidate_caches(self):
+        self._misses.clear()
+        self.dirobj.invalidate()
+
+    def top_level_names(self):
+        """Return the names of the modules, packages and namespace
+        package portions this finder's directory may provide."""
+        suffixes = self.suffixes()
+        names = set()
+        for entry in list(self.dirobj._listing(os.curdir)):
+            kind = self.dirobj._kind(entry)
+            if kind == stat.S_IFDIR:
+                names.add(entry)
+            elif kind == stat.S_IFREG:
+                names.update(entry[:-len(suffix)] for suffix in suffixes
+                             if entry.endswith(suffix))
+        names.discard('')
+        return set(name for name in names if '.' not in name)
+
+    def opendir(self, path):
+        """Return the DirectoryFD for path, a directory beneath this
+        finder's, opening it only if it hasn't been opened before."""
+        with self._lock:
+            dirobj = self._subdirs.get(path)
+            if dirobj is None:
+                dirobj = self._subdirs[path] = self.dirobj.opendir(path)
+                # loaders use it directly, so it's accounted for
+                # whenever it's reopened, not just here.  the
+                # prefetcher reads through copies of its own.
+                dirobj.on_reopen = lambda: self._hold(path, dirobj)
+            else:
+                # reopen it now if it was released
+                dirobj.fileno()
+            self._hold(path, dirobj)
+            return dirobj
+
+    def _hold(self, path, dirobj):
+        """Note that dirobj holds a descriptor, releasing the least
+        recently used others if that makes more than max_dirfds."""
+        with self._lock:
+            self._open_subdirs.pop(path, None)
+            self._open_subdirs[path] = dirobj
+            # never the one just held, which is about to be used
+            while len(self._open_subdirs) > max(self.max_dirfds, 1):
+                _, lru = self._open_subdirs.popitem(last=False)
+                lru.release()
 
     def dirobjs_from_path(self, path):
         if path:
             dirobjs = []
             for p in path:
                 try:
-                    dirobj = self.dirobj.opendir(p)
+                    dirobj = self.opendir(p)
                 except BadPath:
                     return []
+                except OSError as e:
+                    # e.g. a sys.path entry beneath this finder's
+                    # directory that doesn't exist
+                    if e.errno not in (errno.ENOENT, errno.ENOTDIR):
+                        raise
+                    return []
                 dirobjs.append(dirobj)
             return dirobjs
         else:
             return [self.dirobj]
+
+    def close(self):
+        with self._lock:
+            for dirobj in self._subdirs.values():
+                dirobj.close()
+            self._subdirs.clear()
+            self._open_subdirs.clear()
+            self.dirobj.close()
+
+
+class _FindsNothing(object):
+    """The path entry finder for paths outside every OpenatFileFinder's
+    directory, which can't be imported from any more than they could
+    be with the finders on sys.meta_path."""
+
+    def find_spec(self, fullname, target=None):
+        return None
+
+    def find_module(self, fullname, path=None):
+        return None
+
+
+class OpenatPathHook(object):
+    """A sys.path_hooks entry that makes a path entry finder for any
+    path beneath the directory of one of finders, which searches it
+    through that finder's descriptors.
+
+    :param finders: the OpenatFileFinders for the entries on sys.path.
+
+    :param entry_finder: called with one of finders and a path beneath
+    its directory to make a path entry finder.
+    """
+
+    def __init__(self, finders, entry_finder):
+        # the most specific directory wins when entries are nested
+        self.finders = sorted(finders, key=lambda finder: len(finder.path),
+                              reverse=True)
+        self.entry_finder = entry_finder
+
+    def __call__(self, path):
+        for finder in self.finders:
+            if path == finder.path or path.startswith(
+                    os.path.join(finder.path, '')):
+                return self.entry_finder(finder, path)
+        return _FindsNothing()
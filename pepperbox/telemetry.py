@@ -0,0 +1,194 @@
+import atexit
+import errno
+import fcntl
+import json
+import os
+import resource
+import select
+import socket
+import stat
+import struct
+import time
+
+
+# payload length, record kind
+_RECORD = struct.Struct('!IH')
+
+STATS = 1
+RUSAGE = 2
+TRACE = 3
+PROFILE = 4
+IMPORTS = 5
+
+_RUSAGE_FIELDS = ('ru_utime', 'ru_stime', 'ru_maxrss', 'ru_minflt',
+                  'ru_majflt', 'ru_inblock', 'ru_oublock', 'ru_nvcsw',
+                  'ru_nivcsw')
+
+CHANNEL = None
+
+
+class Channel(object):
+    """Sends length-prefixed records out of the sandbox over a pipe or
+    socket opened before it was entered.
+
+    Records are buffered in memory and written without blocking, so a
+    slow reader never stalls the sandboxed process.  Once max_buffer
+    bytes are waiting, new records are dropped and counted in
+    dropped.
+
+    :param fd: the descriptor to write to.  A socket is written with
+    MSG_DONTWAIT.  A pipe has no such flag, so it's made non-blocking,
+    which also affects every other descriptor for the same pipe; give
+    a socket unless this end of the pipe is the channel's alone.
+
+    :param flush_size: buffer at least this many bytes before trying
+    to write them.
+    """
+
+    def __init__(self, fd, max_buffer=1024 * 1024, flush_size=4096):
+        self.fd = fd
+        self.max_buffer = max_buffer
+        self.flush_size = flush_size
+        self.dropped = 0
+        self.closed = False
+        self._buffer = bytearray()
+        self._busy = False
+        self._deferred = []
+        self._socket = None
+        if stat.S_ISSOCK(os.fstat(fd).st_mode):
+            self._socket = socket.fromfd(fd, socket.AF_UNIX,
+                                         socket.SOCK_STREAM)
+        else:
+            flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+            fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+    def _exclusively(self, method, *args):
+        self._busy = True
+        try:
+            return method(*args)
+        finally:
+            self._busy = False
+            deferred, self._deferred = self._deferred, []
+            for func in deferred:
+                func()
+
+    def defer(self, func):
+        """Call func now, or, if a send or flush is under way, as soon
+        as it's finished.  A signal handler that uses the channel must
+        go through this, since it may have interrupted one."""
+        if self._busy:
+            self._deferred.append(func)
+        else:
+            func()
+
+    def send(self, kind, payload):
+        """Queue a record of kind with the bytes payload.  Returns
+        False if it was dropped."""
+        return self._exclusively(self._send, kind, payload)
+
+    def _send(self, kind, payload):
+        if self.closed or (len(self._buffer) + _RECORD.size + len(payload)
+                           > self.max_buffer):
+            self.dropped += 1
+            return False
+        self._buffer += _RECORD.pack(len(payload), kind)
+        self._buffer += payload
+        if len(self._buffer) >= self.flush_size:
+            self._flush()
+        return True
+
+    def send_json(self, kind, obj):
+        return self.send(kind, json.dumps(obj).encode('utf-8'))
+
+    def trace(self, event):
+        """A pepperbox.trace sink that sends each event as a TRACE
+        record."""
+        self.send_json(TRACE, event)
+
+    def flush(self):
+        """Write as much of the buffer as the descriptor accepts
+        without blocking.  Returns True if the buffer was emptied."""
+        return self._exclusively(self._flush)
+
+    def _flush(self):
+        while self._buffer:
+            try:
+                if self._socket is not None:
+                    written = self._socket.send(self._buffer,
+                                                socket.MSG_DONTWAIT)
+                else:
+                    written = os.write(self.fd, self._buffer)
+            except (IOError, OSError) as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return False
+                if e.errno == errno.EINTR:
+                    continue
+                # the reader's gone; nothing buffered can be delivered
+                self._buffer = bytearray()
+                self.closed = True
+                return False
+            del self._buffer[:written]
+        return True
+
+    def drain(self, timeout=1.0):
+        """Flush the buffer, waiting up to timeout seconds for the
+        descriptor to accept it all."""
+        deadline = time.time() + timeout
+        while not self.flush() and not self.closed:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            select.select([], [self.fd], [], remaining)
+        return not self._buffer
+
+    def close(self, timeout=1.0):
+        self.drain(timeout)
+        self.closed = True
+        if self._socket is not None:
+            self._socket.close()
+        os.close(self.fd)
+
+
+def read_records(fileobj):
+    """Yield (kind, payload) for each record read from fileobj until
+    it's exhausted."""
+    while True:
+        header = fileobj.read(_RECORD.size)
+        if len(header) < _RECORD.size:
+            return
+        length, kind = _RECORD.unpack(header)
+        payload = fileobj.read(length)
+        if len(payload) < length:
+            return
+        yield kind, payload
+
+
+def rusage():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return dict((field, getattr(usage, field)) for field in _RUSAGE_FIELDS)
+
+
+def report(channel):
+    """Send pepperbox.loader.stats(), this process's resource usage
+    and, if imports are being recorded, an import profile."""
+    import pepperbox.loader
+    from pepperbox.importlog import RECORDER, format_profile
+    channel.send_json(STATS, pepperbox.loader.stats())
+    channel.send_json(RUSAGE, rusage())
+    if RECORDER.recording:
+        channel.send(IMPORTS,
+                     format_profile(RECORDER.names()).encode('utf-8'))
+
+
+def _report_and_close():
+    report(CHANNEL)
+    CHANNEL.close()
+
+
+def open_channel(fd):
+    """Make fd the process's telemetry channel.  Statistics and
+    resource usage are sent over it when the process exits."""
+    global CHANNEL
+    CHANNEL = Channel(fd)
+    atexit.register(_report_and_close)
+    return CHANNEL
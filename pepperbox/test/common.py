@@ -1,3 +1,5 @@
+import os
+import pkgutil
 import sys
 import pytest
 
@@ -7,3 +9,19 @@ IS_PYTHON_34 = sys.version_info.major == 3 and sys.version_info.minor == 4
 
 only_py27 = pytest.mark.skipif(not IS_PYTHON_27, reason='only for Python 2.7')
 only_py34 = pytest.mark.skipif(not IS_PYTHON_34, reason='only for Python 3.4')
+
+
+def unimported_extension():
+    """Return the name of an extension module that hasn't been
+    imported, and the directory it's in, or skip the test."""
+    from pepperbox.image import _extension_suffixes
+    suffixes = tuple(_extension_suffixes())
+    for name in ('_testbuffer', '_testimportmultiple', 'xxlimited',
+                 '_xxtestfuzz', 'audioop', '_lsprof'):
+        if name in sys.modules:
+            continue
+        loader = pkgutil.get_loader(name)
+        if loader is not None and loader.get_filename(name).endswith(
+                suffixes):
+            return name, os.path.dirname(loader.get_filename(name))
+    pytest.skip('no unimported extension module to load')
@@ -0,0 +1,204 @@
+import fcntl
+import os
+import sys
+
+import pytest
+from pepperbox import image as I
+from pepperbox import _ffi
+from pepperbox.restrict import limit_resources
+from .common import IS_PYTHON_27, unimported_extension
+
+
+EXTENSION_CONTENTS = b'\x7fELF and so on'
+
+
+@pytest.fixture
+def package(tmpdir, monkeypatch):
+    pkg = tmpdir.mkdir('image_pkg')
+    pkg.join('__init__.py').write('VALUE = "package"\n')
+    pkg.join('module.py').write('VALUE = "module"\n')
+    monkeypatch.syspath_prepend(str(tmpdir))
+    yield pkg
+    for name in 'image_pkg', 'image_pkg.module':
+        sys.modules.pop(name, None)
+
+
+@pytest.fixture
+def image_path(package, tmpdir):
+    path = tmpdir.join('modules.pbxi')
+    with path.open('wb') as f:
+        I.build(f, ['image_pkg'], recursive=True)
+    return path
+
+
+def test_build_and_read(image_path):
+    image = I.open_image(str(image_path))
+    assert sorted(image) == ['image_pkg', 'image_pkg.module']
+
+    package = image.get('image_pkg')
+    assert package.kind == I.CODE
+    assert package.is_package
+    assert package.filename == 'image_pkg/__init__.py'
+    assert image.path('image_pkg.module') == str(
+        image_path.join('image_pkg', 'module.py'))
+
+    namespace = {}
+    exec(image.code('image_pkg.module'), namespace)
+    assert namespace['VALUE'] == 'module'
+    assert image.source('image_pkg.module') == b'VALUE = "module"\n'
+    assert image.get('missing') is None
+
+
+def test_build_memfd(package):
+    fd = I.build_memfd(['image_pkg'], recursive=True)
+    try:
+        image = I.open_image(fd)
+        assert sorted(image) == ['image_pkg', 'image_pkg.module']
+        assert image.path('image_pkg.module') == os.path.join(
+            '<image {}>'.format(fd), 'image_pkg', 'module.py')
+        namespace = {}
+        exec(image.code('image_pkg.module'), namespace)
+        assert namespace['VALUE'] == 'module'
+
+        if hasattr(os, 'memfd_create') and hasattr(fcntl, 'F_ADD_SEALS'):
+            with pytest.raises(OSError):
+                os.write(fd, b'changed')
+    finally:
+        os.close(fd)
+
+
+@pytest.fixture
+def extension_image(tmpdir, monkeypatch):
+    # only copied, never loaded, so any bytes will do
+    tmpdir.join('image_ext' + I._extension_suffixes()[0]).write_binary(
+        EXTENSION_CONTENTS)
+    tmpdir.join('image_source.py').write('VALUE = 1\n')
+    monkeypatch.syspath_prepend(str(tmpdir))
+    fd = I.build_memfd(['image_ext', 'image_source'])
+    yield I.open_image(fd)
+    os.close(fd)
+    sys.modules.pop('image_source', None)
+
+
+def test_extension_fd(extension_image):
+    assert extension_image.get('image_ext').kind == I.EXTENSION
+    extension_fd = extension_image.extension_fd('image_ext')
+    assert extension_image.extension_fd('image_ext') == extension_fd
+    assert os.read(extension_fd, 1024) == EXTENSION_CONTENTS
+    os.close(extension_fd)
+
+
+def test_open_extensions(extension_image):
+    extension_image.open_extensions()
+    assert list(extension_image._extension_fds) == ['image_ext']
+    os.close(extension_image.extension_fd('image_ext'))
+
+
+def test_image_finder_loaders(extension_image):
+    if IS_PYTHON_27:
+        from pepperbox.py27 import loader as L
+    else:
+        from pepperbox.py34 import loader as L
+
+    def find_loader(finder, fullname):
+        if IS_PYTHON_27:
+            return finder.find_module(fullname)
+        return finder.find_spec(fullname).loader
+
+    finder = L.OpenatImageFinder(extension_image)
+    # extension modules are copied before the sandbox is entered
+    assert list(extension_image._extension_fds) == ['image_ext']
+
+    extension_loader = find_loader(finder, 'image_ext')
+    assert type(extension_loader) is L.OpenatImageExtensionLoader
+    assert type(find_loader(finder, 'image_source')) is L.OpenatImageLoader
+    assert extension_loader.get_source('image_ext') is None
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='requires fork')
+def test_extension_import_within_resource_limits():
+    from pepperbox.loader import install
+
+    name, _ = unimported_extension()
+    fd = I.build_memfd([name])
+    try:
+        pid = os.fork()
+        if not pid:
+            status = 1
+            try:
+                sys.meta_path[:] = []
+                install(rights=(), image=fd)
+                # RLIMIT_FSIZE forbids copying it into memory from now on
+                limit_resources()
+                __import__(name)
+                status = 0
+            except ImportError as e:
+                if 'cannot load extension modules' in str(e):
+                    status = 2
+            finally:
+                os._exit(status)
+        _, status = os.waitpid(pid, 0)
+    finally:
+        os.close(fd)
+
+    assert os.WIFEXITED(status)
+    # without pepperbox's compiled helpers, the import can get no
+    # further than loading it
+    assert os.WEXITSTATUS(status) == (0 if _ffi.load() else 2)
+
+
+def test_install_image(package, tmpdir, monkeypatch):
+    from pepperbox.loader import install, OpenatImageFinder
+
+    tmpdir.join('image_module.py').write('VALUE = "top level"\n')
+    path = tmpdir.join('modules.pbxi')
+    with path.open('wb') as f:
+        I.build(f, ['image_module', 'image_pkg', 'image_pkg.module'])
+    # building imported the package from sys.path; the image takes
+    # precedence over it
+    package.join('module.py').write('VALUE = "changed"\n')
+    for name in 'image_pkg', 'image_pkg.module':
+        sys.modules.pop(name, None)
+
+    monkeypatch.setattr(sys, 'meta_path', list(sys.meta_path))
+    monkeypatch.setattr(sys, 'path_hooks', list(sys.path_hooks))
+    install(rights=(), image=str(path))
+    assert isinstance(sys.meta_path[0], OpenatImageFinder)
+    try:
+        import image_module
+        import image_pkg.module
+
+        assert image_module.VALUE == 'top level'
+        assert image_module.__file__ == str(path.join('image_module.py'))
+
+        assert image_pkg.VALUE == 'package'
+        assert image_pkg.__file__ == str(path.join('image_pkg',
+                                                   '__init__.py'))
+        assert image_pkg.__path__ == [str(path.join('image_pkg'))]
+
+        module = image_pkg.module
+        assert module.VALUE == 'module'
+        assert module.__file__ == str(path.join('image_pkg', 'module.py'))
+        assert module.__loader__.get_source(
+            'image_pkg.module') == 'VALUE = "module"\n'
+    finally:
+        sys.modules.pop('image_module', None)
+
+
+def test_build_without_sources(package, tmpdir):
+    path = tmpdir.join('modules.pbxi')
+    with path.open('wb') as f:
+        I.build(f, ['image_pkg.module'], sources=False)
+    assert I.open_image(str(path)).source('image_pkg.module') is None
+
+
+def test_bad_images(tmpdir):
+    short = tmpdir.join('short')
+    short.write_binary(b'PBXI')
+    with pytest.raises(I.BadImage):
+        I.open_image(str(short))
+
+    wrong_magic = tmpdir.join('wrong_magic')
+    wrong_magic.write_binary(b'\0' * 64)
+    with pytest.raises(I.BadImage):
+        I.open_image(str(wrong_magic))
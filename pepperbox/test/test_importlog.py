@@ -0,0 +1,98 @@
+import io
+import os
+import sys
+
+import pytest
+from pepperbox import importlog as I
+from pepperbox import telemetry as T
+
+
+@pytest.fixture
+def package(tmpdir, monkeypatch):
+    pkg = tmpdir.mkdir('recorded_pkg')
+    pkg.join('__init__.py').ensure()
+    pkg.join('module.py').ensure()
+    monkeypatch.syspath_prepend(str(tmpdir))
+    yield pkg
+    for name in 'recorded_pkg', 'recorded_pkg.module':
+        sys.modules.pop(name, None)
+
+
+def test_Recorder(package):
+    recorder = I.Recorder()
+    recorder.start()
+    try:
+        assert recorder.recording
+        import recorded_pkg.module
+        with pytest.raises(ImportError):
+            import recorded_pkg.missing
+    finally:
+        recorder.stop()
+    assert not recorder.recording
+    assert recorder.names() == ['recorded_pkg', 'recorded_pkg.module']
+
+
+def test_profile_round_trip():
+    f = io.StringIO()
+    I.write_profile(f, [u'a', u'a.b'])
+    f.seek(0)
+    assert f.readline().startswith(u'#')
+    f.seek(0)
+    assert I.read_profile(f) == ['a', 'a.b']
+    assert I.read_profile([' \n', '# comment\n', 'c\n']) == ['c']
+
+
+def test_merge():
+    assert I.merge([['a', 'b'], ['c', 'a'], ['d']]) == ['a', 'b', 'c', 'd']
+
+
+def test_main(tmpdir):
+    r, w = os.pipe()
+    channel = T.Channel(w)
+    channel.send(T.STATS, b'{}')
+    channel.send(T.IMPORTS, I.format_profile(['b', 'c']).encode('utf-8'))
+    channel.close()
+    records = tmpdir.join('telemetry')
+    with os.fdopen(r, 'rb') as f:
+        records.write(f.read(), mode='wb')
+
+    output = tmpdir.join('profile')
+    output.write('a\nb\n')
+    I.main(['-o', str(output), '--merge', str(records)])
+    with output.open() as f:
+        assert I.read_profile(f) == ['a', 'b', 'c']
+
+
+@pytest.fixture
+def import_profile(package, tmpdir, monkeypatch):
+    # recorded before recorded_pkg.gone and stale_module were removed
+    profile = tmpdir.join('profile')
+    with profile.open('w') as f:
+        I.write_profile(f, ['recorded_pkg', 'recorded_pkg.gone',
+                            'stale_module', 'recorded_pkg.module'])
+    monkeypatch.setattr(sys, 'meta_path', list(sys.meta_path))
+    return str(profile)
+
+
+def test_install_replay_preimport(import_profile):
+    from pepperbox.loader import install
+
+    install(rights=(), import_profile=import_profile, replay='preimport')
+    assert 'recorded_pkg.module' in sys.modules
+    assert 'recorded_pkg.gone' not in sys.modules
+    assert 'stale_module' not in sys.modules
+
+
+def test_install_replay_warm(import_profile, monkeypatch):
+    from pepperbox.loader import install, stats
+    from pepperbox.support import CODE_CACHE
+
+    monkeypatch.setattr(CODE_CACHE, '_code', {})
+    install(rights=(), import_profile=import_profile, replay='warm')
+    # recorded_pkg and recorded_pkg.module, but nothing is imported
+    assert len(CODE_CACHE) == 2
+    assert 'recorded_pkg' not in sys.modules
+
+    code_cached = stats()['code_cached']
+    import recorded_pkg.module
+    assert stats()['code_cached'] == code_cached + 2
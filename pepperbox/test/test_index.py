@@ -0,0 +1,110 @@
+import stat
+
+import pytest
+from pepperbox.index import (ModuleIndex, BadManifest, scan, seed_finders,
+                             load_manifest, write_manifest)
+from pepperbox.support import BaseOpenatFileFinder
+
+
+class PyFinder(BaseOpenatFileFinder):
+
+    def suffixes(self):
+        return ['.py', '.pyc']
+
+
+@pytest.fixture
+def entries(tmpdir):
+    first, second = tmpdir.mkdir('first'), tmpdir.mkdir('second')
+    first.join('shared.py').ensure()
+    first.join('only_first.pyc').ensure()
+    first.join('pkg').ensure(dir=True).join('__init__.py').ensure()
+    second.join('shared.py').ensure()
+    second.join('only_second.py').ensure()
+    second.join('README.txt').ensure()
+    return first, second
+
+
+@pytest.fixture
+def index(entries):
+    return ModuleIndex([PyFinder(str(entry), rights=()) for entry in entries])
+
+
+def test_top_level_names(entries):
+    first, _ = entries
+    finder = PyFinder(str(first), rights=())
+    assert finder.top_level_names() == set(['shared', 'only_first', 'pkg'])
+
+
+def test_finders_for_top_level(index):
+    first, second = index.finders
+    assert index.finders_for('shared') == [first, second]
+    assert index.finders_for('only_second') == [second]
+    assert index.finders_for('pkg') == [first]
+    assert not index.finders_for('README')
+    assert not index.finders_for('missing')
+
+
+def test_finders_for_submodule(index, entries):
+    first, second = index.finders
+    pkg_path = [str(entries[0].join('pkg'))]
+    assert index.finders_for('pkg.module', pkg_path) == [first]
+    assert not index.finders_for('pkg.module', ['/elsewhere'])
+
+
+def test_rebuild(index, entries):
+    _, second = index.finders
+    entries[1].join('new.py').ensure()
+    assert not index.finders_for('new')
+
+    second.dirobj.invalidate()
+    index.rebuild()
+    assert index.finders_for('new') == [second]
+
+
+def test_manifest_round_trip(entries, tmpdir):
+    manifest_path = tmpdir.join('manifest')
+    with manifest_path.open('wb') as f:
+        write_manifest(f, [str(entry) for entry in entries])
+    with manifest_path.open('rb') as f:
+        manifest = load_manifest(f)
+
+    first = manifest[str(entries[0])]
+    assert set(first) == set(['.', 'pkg'])
+    assert first['.'][3]['pkg'][0] == stat.S_IFDIR
+    assert first['pkg'][3]['__init__.py'][0] == stat.S_IFREG
+
+
+def test_load_manifest_rejects_other_versions(tmpdir):
+    manifest_path = tmpdir.join('manifest')
+    manifest_path.write_binary(b'PBXM 0 cpython_00\n')
+    with manifest_path.open('rb') as f:
+        with pytest.raises(BadManifest):
+            load_manifest(f)
+
+
+def test_seeded_finders_skip_listing(entries, monkeypatch):
+    finders = [PyFinder(str(entry), rights=()) for entry in entries]
+    manifest = dict((str(entry), scan(str(entry))) for entry in entries)
+    seed_finders(finders, manifest)
+
+    def no_scandir():
+        raise AssertionError('unexpected listing')
+
+    for finder in finders:
+        monkeypatch.setattr(finder.dirobj._dirobj, 'scandir', no_scandir)
+
+    index = ModuleIndex(finders)
+    assert index.finders_for('only_second') == [finders[1]]
+    assert finders[0].dirobj.isfile('pkg/__init__.py')
+
+
+def test_stale_seed_is_ignored(entries):
+    first = entries[0]
+    listings = scan(str(first))
+    first.join('pkg', 'new.py').ensure()
+    pkg_mtime = first.join('pkg').mtime()
+    first.join('pkg').setmtime(pkg_mtime + 10)
+
+    finder = PyFinder(str(first), rights=())
+    finder.dirobj.seed(listings)
+    assert finder.dirobj.isfile('pkg/new.py')
@@ -3,15 +3,18 @@ from itertools import chain
 import imp
 import importlib
 import os
+import pkgutil
 import py_compile
 import subprocess
 import sys
+import zipfile
 
 import pytest
 import py.path
 
 from ..support import PY_TAG, DirectoryFD
-from .common import IS_PYTHON_27, only_py27, only_py34
+from .common import (IS_PYTHON_27, only_py27, only_py34,
+                     unimported_extension)
 
 FIXTURE_SETUPS = {}
 
@@ -700,19 +703,56 @@ class TestsPy27Loader(object):
         mod = OpenatFileFinder(str(tmpdir), rights=()).find_module('sys')
         assert mod is None
 
+    def test_finder_caches_misses(self, tmpdir):
+        from pepperbox.py27.loader import OpenatFileFinder
+
+        finder = OpenatFileFinder(str(tmpdir), rights=())
+        assert finder.find_module('late') is None
+
+        tmpdir.join('late.py').ensure()
+        assert finder.find_module('late') is None
+
+        finder.invalidate_caches()
+        assert finder.find_module('late') is not None
+
+    def test_finder_lazy(self, tmpdir):
+        from pepperbox.py27.loader import OpenatFileFinder
+        from pepperbox.support import LazyPolicy
+
+        tmpdir.join('lazy_module.py').write('import sys\n'
+                                            'sys.lazy_module_ran = True\n'
+                                            'VALUE = 1\n')
+        finder = OpenatFileFinder(str(tmpdir), rights=(),
+                                  lazy=LazyPolicy(allow=['lazy_module']))
+        try:
+            module = finder.find_module('lazy_module').load_module(
+                'lazy_module')
+            assert module.__name__ == 'lazy_module'
+            assert not hasattr(sys, 'lazy_module_ran')
+            assert module.VALUE == 1
+            assert sys.lazy_module_ran
+        finally:
+            sys.modules.pop('lazy_module', None)
+            sys.__dict__.pop('lazy_module_ran', None)
+
     def test_finder_repr(self, tmpdir):
         from pepperbox.py27.loader import OpenatFileFinder
         repr(OpenatFileFinder(str(tmpdir), rights=()))
 
     @pytest.mark.parametrize_finder_tests
-    def test_py27_finder(self, category, setup_fixture, loader_tests):
-        from pepperbox.py27.loader import OpenatFileFinder
+    @pytest.mark.parametrize('indexed', [False, True])
+    def test_py27_finder(self, category, setup_fixture, loader_tests,
+                         indexed):
+        from pepperbox.py27.loader import (OpenatFileFinder,
+                                           IndexedOpenatFileFinder)
 
         fixture = setup_fixture()
         tests = loader_tests()
 
         finder = OpenatFileFinder(str(self.fixture_dir),
                                   rights=())
+        if indexed:
+            finder = IndexedOpenatFileFinder([finder])
 
         module_name = fixture.module.__name__
         package = fixture.package
@@ -760,8 +800,11 @@ def test_py34_loaders(category, setup_fixture, loader_tests):
 
 @only_py34
 @pytest.mark.parametrize_finder_tests
-def test_py34_finder(category, setup_fixture, loader_tests, pytestconfig):
-    from pepperbox.py34.loader import OpenatFileFinder
+@pytest.mark.parametrize('indexed', [False, True])
+def test_py34_finder(category, setup_fixture, loader_tests, pytestconfig,
+                     indexed):
+    from pepperbox.py34.loader import (OpenatFileFinder,
+                                       IndexedOpenatFileFinder)
 
     fixture_dir = pytestconfig.getoption('fixture_dir')
 
@@ -770,6 +813,8 @@ def test_py34_finder(category, setup_fixture, loader_tests, pytestconfig):
 
     finder = OpenatFileFinder(str(fixture_dir),
                               rights=())
+    if indexed:
+        finder = IndexedOpenatFileFinder([finder])
 
     module_name = fixture.module.__name__
     package = fixture.package
@@ -785,3 +830,224 @@ def test_py34_finder(category, setup_fixture, loader_tests, pytestconfig):
         assert spec is None
 
     assert isinstance(spec.loader, tests.loader_cls)
+
+
+@only_py34
+def test_py34_finder_caches_misses(tmpdir):
+    from pepperbox.py34.loader import OpenatFileFinder
+
+    finder = OpenatFileFinder(str(tmpdir), rights=())
+    assert finder.find_spec('late') is None
+
+    tmpdir.join('late.py').ensure()
+    assert finder.find_spec('late') is None
+
+    finder.invalidate_caches()
+    assert finder.find_spec('late') is not None
+
+
+def _lazy_loaders():
+    if IS_PYTHON_27:
+        return []
+    import importlib.util
+    from pepperbox.py34.loader import LazyOpenatLoader
+    loaders = [LazyOpenatLoader]
+    if hasattr(importlib.util, 'LazyLoader'):
+        loaders.append(importlib.util.LazyLoader)
+    return loaders
+
+
+@pytest.mark.skipif(IS_PYTHON_27, reason='importlib loaders only')
+@pytest.mark.parametrize('lazy_loader', _lazy_loaders())
+def test_py34_finder_lazy(tmpdir, monkeypatch, lazy_loader):
+    from pepperbox.py34 import loader as L
+    from pepperbox.support import LazyPolicy
+
+    monkeypatch.setattr(L, '_LazyLoader', lazy_loader)
+    for name in 'lazy_module', 'eager_module':
+        tmpdir.join(name + '.py').write('import sys\n'
+                                        'sys.{0}_ran = True\n'
+                                        'VALUE = 1\n'.format(name))
+    finder = L.OpenatFileFinder(str(tmpdir), rights=(),
+                                lazy=LazyPolicy(deny=['eager_module']))
+    assert isinstance(finder.find_spec('lazy_module').loader, lazy_loader)
+    monkeypatch.setattr(sys, 'meta_path', [finder] + sys.meta_path)
+    try:
+        import lazy_module
+        import eager_module
+        assert sys.eager_module_ran
+        assert not hasattr(sys, 'lazy_module_ran')
+        assert lazy_module.VALUE == 1
+        assert sys.lazy_module_ran
+    finally:
+        for name in 'lazy_module', 'eager_module':
+            sys.modules.pop(name, None)
+            sys.__dict__.pop(name + '_ran', None)
+
+
+@pytest.mark.skipif(IS_PYTHON_27, reason='importlib loaders only')
+def test_py34_get_data_returns_bytes(tmpdir, monkeypatch):
+    from importlib.util import cache_from_source
+    from pepperbox.py34.loader import OpenatFileFinder
+    from pepperbox.support import MMAP_THRESHOLD
+
+    source = tmpdir.join('mapped_module.py')
+    source.write('VALUE = {!r}\n'.format('x' * MMAP_THRESHOLD))
+    py_compile.compile(str(source), doraise=True)
+    finder = OpenatFileFinder(str(tmpdir), rights=())
+    loader = finder.find_spec('mapped_module').loader
+
+    views = []
+    get_data_view = loader.get_data_view
+    monkeypatch.setattr(loader, 'get_data_view',
+                        lambda path: views.append(path) or
+                        get_data_view(path))
+
+    # bytecode is only read into a view, or mapped, for get_code
+    bytecode = cache_from_source(str(source))
+    assert type(loader.get_data(bytecode)) is bytes
+    assert loader.get_code('mapped_module') is not None
+    assert views == [bytecode]
+    assert type(loader.get_data(str(source))) is bytes
+
+
+def test_ffi_loaded_on_demand():
+    """Importing the loaders doesn't import the compiled ffi module or
+    cffi's backend; only install, or loading an extension module,
+    does."""
+    script = ('import sys, pepperbox.loader\n'
+              'print(sorted(name for name in sys.modules\n'
+              "             if 'cffi' in name or 'pepperbox_ffi' in name))\n")
+    root = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+    output = subprocess.check_output([sys.executable, '-c', script],
+                                     cwd=root)
+    assert output.strip() == b'[]'
+
+
+def test_ffi_load_is_not_reentrant(monkeypatch):
+    """Importing the compiled ffi module through a finder that needs
+    it fails rather than recursing."""
+    from pepperbox import _ffi
+
+    class NeedsFFI(object):
+        def find_spec(self, fullname, path=None, target=None):
+            if fullname == 'pepperbox._pepperbox_ffi':
+                _ffi.fdlopen(0, _ffi.RTLD_NOW)
+
+        find_module = find_spec
+
+    monkeypatch.setattr(_ffi, 'lib', None)
+    monkeypatch.setattr(_ffi, '_error', None)
+    monkeypatch.delitem(sys.modules, 'pepperbox._pepperbox_ffi',
+                        raising=False)
+    monkeypatch.setattr(sys, 'meta_path', [NeedsFFI()] + sys.meta_path)
+    assert not _ffi.load()
+    with pytest.raises(ImportError):
+        _ffi.fdlopen(0, _ffi.RTLD_NOW)
+
+
+def test_extension_import_after_install(monkeypatch):
+    pytest.importorskip('pepperbox._pepperbox_ffi')
+    from pepperbox.loader import install, stats
+
+    name, directory = unimported_extension()
+    monkeypatch.setattr(sys, 'path', [directory])
+    monkeypatch.setattr(sys, 'meta_path', list(sys.meta_path))
+    monkeypatch.delitem(sys.modules, name, raising=False)
+    install(rights=())
+    extensions_loaded = stats()['extensions_loaded']
+    __import__(name)
+    assert stats()['extensions_loaded'] == extensions_loaded + 1
+
+
+def test_zip_finder(tmpdir, monkeypatch):
+    from pepperbox.loader import OpenatZipFinder
+
+    archive = str(tmpdir.join('app.zip'))
+    with zipfile.ZipFile(archive, 'w') as zf:
+        zf.writestr('zipped_pkg/__init__.py', 'VALUE = "package"\n')
+        zf.writestr('zipped_pkg/module.py', 'VALUE = "module"\n')
+        zf.writestr('zipped_pkg/data.txt', 'resource')
+        zf.writestr('lib/zipped_lib.py', 'VALUE = "lib"\n')
+    finders = [OpenatZipFinder(archive, rights=()),
+               OpenatZipFinder(os.path.join(archive, 'lib'), rights=())]
+    monkeypatch.setattr(sys, 'meta_path', finders)
+    try:
+        import zipped_pkg.module
+        import zipped_lib
+
+        assert zipped_pkg.VALUE == 'package'
+        assert zipped_pkg.module.VALUE == 'module'
+        assert zipped_pkg.module.__file__ == os.path.join(
+            archive, 'zipped_pkg', 'module.py')
+        assert zipped_lib.VALUE == 'lib'
+        assert pkgutil.get_data('zipped_pkg', 'data.txt') == b'resource'
+        with pytest.raises(ImportError):
+            import zipped_pkg.missing  # noqa: F401
+    finally:
+        for name in 'zipped_pkg', 'zipped_pkg.module', 'zipped_lib':
+            sys.modules.pop(name, None)
+        for finder in finders:
+            finder.close()
+
+
+def test_install_path_hooks(tmpdir, monkeypatch):
+    from pepperbox.loader import install, stats, OpenatPathEntryFinder
+
+    pkg = tmpdir.mkdir('hooked_pkg')
+    pkg.join('__init__.py').ensure()
+    pkg.join('module.py').write('VALUE = 1\n')
+    monkeypatch.setattr(sys, 'path',
+                        [str(tmpdir), str(tmpdir.join('missing'))])
+    monkeypatch.setattr(sys, 'meta_path', list(sys.meta_path))
+    monkeypatch.setattr(sys, 'path_hooks', list(sys.path_hooks))
+    monkeypatch.setattr(sys, 'path_importer_cache', {})
+    install(rights=(), mode='path_hooks')
+    try:
+        import hooked_pkg.module
+        assert hooked_pkg.module.VALUE == 1
+        assert isinstance(sys.path_importer_cache[str(pkg)],
+                          OpenatPathEntryFinder)
+        with pytest.raises(ImportError):
+            import hooked_pkg.missing  # noqa: F401
+        # the missing sys.path entry's finder finds nothing
+        with pytest.raises(ImportError):
+            import hooked_missing  # noqa: F401
+
+        finder, = stats()['finders']
+        assert finder['path'] == str(tmpdir)
+        assert finder['hits'] == 2
+    finally:
+        for name in 'hooked_pkg', 'hooked_pkg.module':
+            sys.modules.pop(name, None)
+
+    with pytest.raises(ValueError):
+        install(rights=(), mode='path_hooks', index=True)
+
+
+def test_install_warm_modules(tmpdir, monkeypatch):
+    from pepperbox.loader import install, stats
+    from pepperbox.support import CODE_CACHE
+
+    source = tmpdir.join('warmed_module.py')
+    source.write('VALUE = "warm"\n')
+    mtime = 1000000000
+    source.setmtime(mtime)
+    monkeypatch.setattr(sys, 'path', [str(tmpdir)])
+    monkeypatch.setattr(sys, 'meta_path', list(sys.meta_path))
+    monkeypatch.setattr(sys, 'dont_write_bytecode', True)
+    monkeypatch.setattr(CODE_CACHE, '_code', {})
+    install(rights=(), warm_modules=['warmed_module'])
+    assert len(CODE_CACHE) == 1
+
+    # the same size and mtime, so only reading the file could tell
+    # the cached code from the source's
+    source.write('VALUE = "cold"\n')
+    source.setmtime(mtime)
+    code_cached = stats()['code_cached']
+    try:
+        import warmed_module
+        assert warmed_module.VALUE == 'warm'
+        assert stats()['code_cached'] == code_cached + 1
+    finally:
+        sys.modules.pop('warmed_module', None)
@@ -0,0 +1,105 @@
+import os
+import select
+import signal
+
+import pytest
+from pepperbox import pool as P
+from pepperbox.zygote import Zygote
+
+
+class ForkingZygote(Zygote):
+    """A Zygote that forks children without sandboxing them."""
+
+    def __init__(self):
+        self.spawned = []
+
+    def enter(self):
+        pass
+
+    def spawn(self, target, *args, **kwargs):
+        pid = Zygote.spawn(self, target, *args, **kwargs)
+        self.spawned.append(pid)
+        return pid
+
+
+def double(x):
+    return x * 2
+
+
+def fail(x):
+    raise ValueError(x)
+
+
+def die(x):
+    if x == 3:
+        os._exit(1)
+    return x
+
+
+def unserializable(x):
+    return object()
+
+
+@pytest.fixture
+def zygote():
+    return ForkingZygote()
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='requires fork')
+@pytest.mark.parametrize('batch_size', [1, 3])
+def test_imap_preserves_order(zygote, batch_size):
+    with P.Pool(2, zygote, batch_size=batch_size) as pool:
+        results = pool.map(double, range(10))
+    assert results == [P.Result(True, x * 2) for x in range(10)]
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='requires fork')
+def test_failures(zygote):
+    with P.Pool(1, zygote) as pool:
+        [failed] = pool.map(fail, ['boom'])
+        [bad] = pool.map(unserializable, [1])
+    assert failed == P.Result(False, 'ValueError: boom')
+    assert not bad.ok
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='requires fork')
+def test_workers_retire(zygote):
+    with P.Pool(1, zygote, max_jobs=2) as pool:
+        assert pool.map(double, range(5)) == [P.Result(True, x * 2)
+                                             for x in range(5)]
+    assert len(zygote.spawned) == 3
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='requires fork')
+def test_dead_worker_replaced(zygote):
+    with P.Pool(1, zygote, batch_size=2) as pool:
+        results = pool.map(die, range(6))
+    assert [r.ok for r in results] == [True, True, False, False, True, True]
+    assert results[2].value == 'worker {} died'.format(zygote.spawned[0])
+    assert len(zygote.spawned) == 2
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='requires fork')
+def test_idle_worker_death(zygote):
+    with P.Pool(1, zygote) as pool:
+        # killed between batches, so sending it the next one fails
+        worker, = pool._workers
+        os.kill(worker.pid, signal.SIGKILL)
+        assert select.select([worker.sock], [], [], 10)[0]
+        results = pool.map(double, [1, 2])
+    assert results == [P.Result(False, 'worker {} died'.format(worker.pid)),
+                       P.Result(True, 4)]
+    assert len(zygote.spawned) == 2
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='requires fork')
+def test_abandoned_imap(zygote):
+    with P.Pool(2, zygote) as pool:
+        results = pool.imap(double, [1, 2, 3, 4])
+        assert next(results) == P.Result(True, 2)
+        assert pool.map(double, [150, 300]) == [P.Result(True, 300),
+                                                P.Result(True, 600)]
+
+        for result in pool.imap(double, range(10)):
+            break
+        assert pool.map(double, [5]) == [P.Result(True, 10)]
@@ -0,0 +1,73 @@
+import sys
+import threading
+
+import pytest
+
+from pepperbox import support as S
+from pepperbox.loader import OpenatFileFinder
+from pepperbox.prefetch import Prefetcher
+
+
+@pytest.fixture
+def package(tmpdir, monkeypatch):
+    pkg = tmpdir.mkdir('prefetched_pkg')
+    pkg.join('__init__.py').write(b'A = 1\n', mode='wb')
+    pkg.join('module.py').write(b'B = 2\n', mode='wb')
+    monkeypatch.setattr(sys, 'meta_path',
+                        [OpenatFileFinder(str(tmpdir), rights=())])
+    yield pkg
+    S.PREFETCHED.clear()
+
+
+@pytest.mark.parametrize('max_bytes', [0, 1024])
+def test_prefetch(package, max_bytes):
+    prefetcher = Prefetcher(threads=2, max_bytes=max_bytes)
+    try:
+        prefetcher.prefetch(['prefetched_pkg.module', 'missing'])
+        prefetcher.wait()
+    finally:
+        prefetcher.close()
+
+    assert prefetcher.fetched == 12
+    init = str(package.join('__init__.py'))
+    module = str(package.join('module.py'))
+    if not max_bytes:
+        assert not S.PREFETCHED
+        return
+    assert len(S.PREFETCHED) == 2
+    assert S.PREFETCHED.take(init) == b'A = 1\n'
+    assert S.PREFETCHED.take(module) == b'B = 2\n'
+    assert S.PREFETCHED.take(module) is None
+
+
+def test_PrefetchCache_evicts_skipped_files():
+    cache = S.PrefetchCache()
+    for order, path in enumerate(['a', 'b', 'c', 'd']):
+        assert cache.put(path, order, path.encode('ascii'))
+    assert cache.take('c') == b'c'
+    # a and b were never taken, and imports have moved on past them
+    assert 'a' not in cache and 'b' not in cache
+    assert not cache.put('b', 1, b'late')
+    assert cache.take('d') == b'd'
+    assert not cache
+
+
+def test_install_replay_prefetch(package, tmpdir, monkeypatch):
+    from pepperbox.loader import install
+
+    profile = tmpdir.join('profile')
+    profile.write('prefetched_pkg\nprefetched_pkg.module\n')
+    monkeypatch.syspath_prepend(str(tmpdir))
+    monkeypatch.setattr(sys, 'path_hooks', list(sys.path_hooks))
+    threads = threading.active_count()
+    install(rights=(), import_profile=str(profile), replay='prefetch')
+    # the reading threads are gone before install returns
+    assert threading.active_count() == threads
+    assert len(S.PREFETCHED) == 2
+    try:
+        import prefetched_pkg.module
+        assert prefetched_pkg.module.B == 2
+        assert not S.PREFETCHED
+    finally:
+        for name in 'prefetched_pkg', 'prefetched_pkg.module':
+            sys.modules.pop(name, None)
@@ -0,0 +1,69 @@
+import os
+import sys
+
+import pytest
+
+from pepperbox import preimport as P
+
+
+NAMES = ['preimported_pkg', 'preimported_pkg.a', 'preimported_pkg.b']
+
+
+@pytest.fixture
+def package(tmpdir, monkeypatch):
+    pkg = tmpdir.mkdir('preimported_pkg')
+    pkg.join('__init__.py').write('')
+    pkg.join('a.py').write('from preimported_pkg import b\n')
+    pkg.join('b.py').write('B = 1\n')
+    pkg.join('broken.py').write('raise ImportError("broken")\n')
+    pkg.join('half.py').write('from preimported_pkg import b\n'
+                              'b.RUNS = getattr(b, "RUNS", 0) + 1\n'
+                              'raise ImportError("half")\n')
+    monkeypatch.syspath_prepend(str(tmpdir))
+    monkeypatch.setattr(sys, 'dont_write_bytecode', False)
+    yield pkg
+    for name in list(sys.modules):
+        if name.startswith('preimported_pkg'):
+            del sys.modules[name]
+
+
+def test_precompile(package):
+    expected = [str(package.join(name))
+                for name in ('__init__.py', 'a.py', 'b.py')]
+    assert sorted(P.stale_sources(['preimported_pkg.a', 'preimported_pkg.b',
+                                   'missing'])) == expected
+    assert P.precompile(NAMES, processes=2) == 3
+    assert P.stale_sources(NAMES) == []
+    assert P.precompile(NAMES, processes=2) == 0
+
+    # it's the source mtime in the bytecode's header that counts, not
+    # the bytecode file's own mtime...
+    b = package.join('b.py')
+    b.write('B = 2\n')
+    mtime = b.stat().mtime
+    os.utime(str(b), (mtime + 10, mtime + 10))
+    for bytecode in package.visit('*.pyc'):
+        os.utime(str(bytecode), (mtime + 100, mtime + 100))
+    assert P.stale_sources(NAMES) == [str(b)]
+    assert P.precompile(NAMES) == 1
+    # ...so an old bytecode file for an unchanged source is current
+    for bytecode in package.visit('*.pyc'):
+        os.utime(str(bytecode), (0, 0))
+    assert P.stale_sources(NAMES) == []
+
+
+@pytest.mark.parametrize('threads', [1, 4])
+def test_preimport(package, threads):
+    P.preimport(NAMES, threads)
+    assert sys.modules['preimported_pkg.a'].b.B == 1
+
+    with pytest.raises(ImportError):
+        P.preimport(['preimported_pkg.broken'] + NAMES, threads)
+    P.preimport(['preimported_pkg.broken'], threads, ignore=(ImportError,))
+
+
+@pytest.mark.parametrize('threads', [1, 4])
+def test_preimport_runs_failed_modules_once(package, threads):
+    P.preimport(['preimported_pkg.half', 'preimported_pkg.a'], threads,
+                ignore=(ImportError,))
+    assert sys.modules['preimported_pkg.b'].RUNS == 1
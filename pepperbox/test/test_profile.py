@@ -0,0 +1,76 @@
+import io
+import os
+import resource
+import signal
+import sys
+
+import pytest
+from pepperbox import profile as P
+from pepperbox import telemetry as T
+
+
+def spin(seconds):
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    deadline = usage.ru_utime + usage.ru_stime + seconds
+    while True:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        if usage.ru_utime + usage.ru_stime >= deadline:
+            return
+
+
+def test_fold():
+    frame = sys._getframe()
+    folded = P.fold(frame, max_depth=64)
+    assert folded.endswith('test_fold ({}:{})'.format(
+        __file__.replace('.pyc', '.py'),
+        test_fold.__code__.co_firstlineno))
+    assert P.fold(frame, max_depth=1).count(';') == 0
+
+
+def test_Sampler_bounds_stacks():
+    sampler = P.Sampler(max_stacks=1)
+    frame = sys._getframe()
+    sampler._sample(signal.SIGPROF, frame)
+    sampler._sample(signal.SIGPROF, frame)
+    sampler._sample(signal.SIGPROF, frame.f_back)
+
+    [(stack, count)] = sampler.stacks.items()
+    assert count == 2
+    assert sampler.overflow == 1
+    assert sampler.folded().splitlines() == ['{} 2'.format(stack),
+                                             '{} 1'.format(P.OVERFLOW)]
+
+
+def test_Sampler_samples():
+    sampler = P.Sampler(interval=0.001)
+    sampler.start()
+    try:
+        spin(0.1)
+    finally:
+        sampler.stop()
+    assert any('spin' in stack for stack in sampler.stacks)
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='requires fork')
+def test_dump_on_SIGXCPU():
+    r, w = os.pipe()
+    pid = os.fork()
+    if not pid:
+        try:
+            os.close(r)
+            resource.setrlimit(resource.RLIMIT_CPU, (1, 5))
+            P.start(T.Channel(w), interval=0.01)
+            spin(10)
+        finally:
+            os._exit(0)
+
+    os.close(w)
+    with io.open(r, 'rb') as f:
+        records = list(T.read_records(f))
+    _, status = os.waitpid(pid, 0)
+
+    assert os.WIFSIGNALED(status)
+    assert os.WTERMSIG(status) == signal.SIGXCPU
+    [(kind, folded)] = records
+    assert kind == T.PROFILE
+    assert b'spin' in folded
@@ -1,3 +1,8 @@
+import io
+import stat
+import threading
+import zipfile
+
 import pytest
 from pepperbox import support as S
 
@@ -92,3 +97,237 @@ def test_DirectoryFD_isdir(test_file, dirobj):
 
 def test_DirectoryFD_listdir(test_file, dirobj):
     assert dirobj.listdir() == [test_file.name]
+
+
+def test_DirectoryFD_lookups_use_listing(tmpdir, monkeypatch):
+    tmpdir.join('pkg').ensure(dir=True).join('__init__.py').ensure()
+    tmpdir.join('module.py').ensure()
+    dirobj = S.DirectoryFD(str(tmpdir))
+
+    # prime the listings of the root and the package
+    assert dirobj.isfile('pkg/__init__.py')
+
+    def no_stat(path):
+        raise AssertionError('unexpected stat of {}'.format(path))
+
+    monkeypatch.setattr(dirobj, 'stat', no_stat)
+
+    assert dirobj.isdir('pkg')
+    assert dirobj.isfile('module.py')
+    assert dirobj.isfile(str(tmpdir.join('pkg', '__init__.py')))
+    assert not dirobj.exists('missing.py')
+    assert not dirobj.exists('pkg/missing.py')
+    assert not dirobj.exists('module.py/missing.py')
+
+
+def test_DirectoryFD_listing_shared_with_opendir(tmpdir):
+    tmpdir.join('pkg').ensure(dir=True).join('module.py').ensure()
+    dirobj = S.DirectoryFD(str(tmpdir))
+    assert dirobj.isfile('pkg/module.py')
+
+    with dirobj.opendir('pkg') as subdir:
+        assert subdir._listing('.') is dirobj._listing('pkg')
+        assert subdir.isfile('module.py')
+
+
+def test_DirectoryFD_resolves_symlinks(tmpdir):
+    tmpdir.join('target').ensure(dir=True)
+    tmpdir.join('link').mksymlinkto(tmpdir.join('target'))
+    tmpdir.join('dangling').mksymlinkto(tmpdir.join('missing'))
+    dirobj = S.DirectoryFD(str(tmpdir))
+
+    assert dirobj.isdir('link')
+    assert not dirobj.exists('dangling')
+
+
+def test_DirectoryFD_invalidate(test_file, dirobj):
+    assert not dirobj.exists('new.txt')
+    test_file.dir.join('new.txt').ensure()
+    assert not dirobj.exists('new.txt')
+
+    dirobj.invalidate()
+    assert dirobj.exists('new.txt')
+
+
+def test_DirectoryFD_release(tmpdir):
+    tmpdir.mkdir('subdir').join('test.txt').write(b'contents')
+    dirobj = S.DirectoryFD(str(tmpdir))
+    subdir = dirobj.opendir('subdir')
+
+    subdir.release()
+    assert subdir.closed
+    with subdir.open('test.txt') as f:
+        assert f.read() == b'contents'
+    assert not subdir.closed
+
+    with pytest.raises(ValueError):
+        dirobj.release()
+
+
+class SubdirFinder(S.BaseOpenatFileFinder):
+    pass
+
+
+def test_BaseOpenatFileFinder_reuses_subdirectories(tmpdir):
+    paths = [str(tmpdir.mkdir(name)) for name in 'abc']
+    finder = SubdirFinder(str(tmpdir), rights=(), max_dirfds=2)
+
+    a, = finder.dirobjs_from_path(paths[:1])
+    assert finder.dirobjs_from_path(paths[:1]) == [a]
+
+    b, c = finder.dirobjs_from_path(paths[1:])
+    assert a.closed
+    assert not b.closed and not c.closed
+
+    assert finder.dirobjs_from_path(paths[:1]) == [a]
+    assert not a.closed
+    assert b.closed
+
+    # used directly, as a loader would, b is reopened in c's place
+    assert b.listdir() == []
+    assert not b.closed
+    assert c.closed
+    assert not a.closed
+
+    finder.close()
+    assert all(d.closed for d in (a, b, c, finder.dirobj))
+
+
+def test_BaseOpenatFileFinder_shares_descriptors_between_threads(tmpdir):
+    # with one descriptor between them, every thread's use of a
+    # directory releases the one another thread just used
+    names = 'abcd'
+    for name in names:
+        tmpdir.mkdir(name).join('module.py').write(name)
+    finder = SubdirFinder(str(tmpdir), rights=(), max_dirfds=1)
+    errors = []
+
+    def read(name):
+        path = str(tmpdir.join(name))
+        try:
+            for _ in range(200):
+                dirobj, = finder.dirobjs_from_path([path])
+                with dirobj.open('module.py') as f:
+                    assert f.read() == name.encode('ascii')
+                assert dirobj.listdir() == ['module.py']
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=read, args=(name,))
+               for name in names]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert len(finder._open_subdirs) == 1
+    finder.close()
+
+
+def test_Stats_count_directory_descriptors(tmpdir, monkeypatch):
+    monkeypatch.setattr(S, 'STATS', S.Stats())
+    tmpdir.mkdir('a').mkdir('b')
+    finder = SubdirFinder(str(tmpdir), rights=(), max_dirfds=1)
+    finder.dirobj.isdir('a/b')
+    a, = finder.dirobjs_from_path([str(tmpdir.join('a'))])
+    b, = finder.dirobjs_from_path([str(tmpdir.join('a', 'b'))])
+    assert a.closed
+
+    counters = S.STATS.as_dict()
+    # the root, the listings of the root and a, a and b
+    assert counters['dirfds_opened'] == 5
+    assert counters['dirfds_held'] == 2
+
+    finder.close()
+    assert S.STATS.as_dict()['dirfds_held'] == 0
+
+    S.STATS.reset()
+    assert not any(S.STATS.as_dict().values())
+
+
+def test_LazyPolicy():
+    everything = S.LazyPolicy(deny=['a.b'])
+    assert everything('a')
+    assert everything('a.bc')
+    assert not everything('a.b')
+    assert not everything('a.b.c')
+
+    allowed = S.LazyPolicy(allow=['a'], deny=['a.b'])
+    assert allowed('a.c')
+    assert not allowed('a.b')
+    assert not allowed('ab')
+
+
+def test_CodeCache(test_file, dirobj):
+    cache = S.CodeCache()
+    code = compile('x = 1', test_file.name, 'exec')
+
+    assert cache.get(dirobj, test_file.name) is None
+    cache.put(dirobj, test_file.name, code)
+    assert len(cache) == 1
+    for path in test_file.paths():
+        assert cache.get(dirobj, path) is code
+    assert cache.get(dirobj, 'missing.py') is None
+
+    test_file.path.write(b'changed contents')
+    assert cache.get(dirobj, test_file.name) is None
+
+
+@pytest.mark.parametrize('threshold', [0, 1024])
+def test_map_or_read(test_file, threshold):
+    with test_file.path.open('rb') as f:
+        assert bytes(S.support.map_or_read(f, threshold)) == b'contents'
+        assert bytes(S.support.map_or_read(f, threshold, 3)) == b'tents'
+
+
+def test_map_or_read_in_memory():
+    f = io.BytesIO(b'contents')
+    assert bytes(S.support.map_or_read(f, 0, 3)) == b'tents'
+
+
+@pytest.fixture
+def archive(tmpdir):
+    path = tmpdir.join('archive.zip')
+    with zipfile.ZipFile(str(path), 'w') as zf:
+        zf.writestr('test.txt', b'contents')
+        zf.writestr('package/module.py', b'')
+    return str(path)
+
+
+def test_split_zip_path(archive, tmpdir):
+    assert S.split_zip_path(archive) == (archive, '')
+    assert S.split_zip_path(archive + '/package/sub') == (archive,
+                                                          'package/sub')
+    assert S.split_zip_path(str(tmpdir)) is None
+    assert S.split_zip_path(str(tmpdir.join('missing'))) is None
+
+
+def test_ZipDirectory(archive):
+    with S.ZipDirectory(archive) as zipdir:
+        for path in 'test.txt', archive + '/test.txt':
+            with zipdir.open(path) as f:
+                assert f.read() == b'contents'
+            assert zipdir.isfile(path)
+        with pytest.raises(S.BadMode):
+            zipdir.open('test.txt', 'w')
+        with pytest.raises(OSError):
+            zipdir.open('missing')
+        with pytest.raises(S.BadPath):
+            zipdir.stat('../outside')
+
+        assert zipdir.isdir('package')
+        assert not zipdir.exists('missing')
+        assert sorted(zipdir.listdir()) == ['package', 'test.txt']
+        st = zipdir.stat('test.txt')
+        assert stat.S_ISREG(st.st_mode)
+        assert st.st_size == len(b'contents')
+        assert st.st_ino != zipdir.stat('package/module.py').st_ino
+
+        package = zipdir.opendir('package')
+        assert package.name == archive + '/package'
+        assert package.isfile('module.py')
+        assert package.isfile(archive + '/package/module.py')
+        assert package.fileno() == zipdir.fileno()
+        package.close()
+        assert not zipdir.closed
+    assert zipdir.closed
@@ -0,0 +1,128 @@
+import fcntl
+import io
+import json
+import os
+import socket
+
+import pytest
+from pepperbox import telemetry as T
+from pepperbox.restrict import restrict
+
+
+@pytest.fixture
+def pipe():
+    r, w = os.pipe()
+    yield r, w
+    for fd in r, w:
+        try:
+            os.close(fd)
+        except OSError:
+            pass
+
+
+def read_all(fd):
+    chunks = []
+    while True:
+        chunk = os.read(fd, 65536)
+        if not chunk:
+            return b''.join(chunks)
+        chunks.append(chunk)
+
+
+def test_round_trip(pipe):
+    r, w = pipe
+    channel = T.Channel(w)
+    assert channel.send(T.TRACE, b'event')
+    assert channel.send_json(T.STATS, {'bytes_read': 1})
+    channel.close()
+
+    records = list(T.read_records(io.BytesIO(read_all(r))))
+    assert records == [(T.TRACE, b'event'),
+                       (T.STATS, b'{"bytes_read": 1}')]
+
+
+def test_full_buffer_drops(pipe):
+    r, w = pipe
+    channel = T.Channel(w, max_buffer=64, flush_size=1024)
+    assert channel.send(T.TRACE, b'x' * 32)
+    assert not channel.send(T.TRACE, b'x' * 32)
+    assert channel.dropped == 1
+
+
+def test_flush_does_not_block(pipe):
+    r, w = pipe
+    channel = T.Channel(w, max_buffer=1 << 24, flush_size=1)
+    for _ in range(64):
+        channel.send(T.TRACE, b'x' * 65536)
+    assert not channel.drain(timeout=0)
+
+    read = os.read(r, 1 << 20)
+    assert read
+
+
+def test_socket_stays_blocking():
+    reader, writer = socket.socketpair()
+    try:
+        fd = os.dup(writer.fileno())
+        channel = T.Channel(fd, max_buffer=1 << 24, flush_size=1)
+        # other descriptors for the socket are left as they were
+        assert not fcntl.fcntl(fd, fcntl.F_GETFL) & os.O_NONBLOCK
+        for _ in range(64):
+            channel.send(T.TRACE, b'x' * 65536)
+        assert not channel.drain(timeout=0)
+        channel.close(timeout=0)
+        assert reader.recv(1 << 20)
+    finally:
+        reader.close()
+        writer.close()
+
+
+def test_telemetry_trace_requires_telemetry_fd():
+    with pytest.raises(ValueError):
+        restrict(telemetry_trace=True)
+
+
+def test_reader_gone(pipe):
+    r, w = pipe
+    os.close(r)
+    channel = T.Channel(w, flush_size=1)
+    channel.send(T.TRACE, b'event')
+    assert channel.closed
+    assert not channel.send(T.TRACE, b'event')
+
+
+def test_defer_waits_for_send(pipe):
+    r, w = pipe
+    channel = T.Channel(w, flush_size=1)
+
+    class Interrupting(bytes):
+        """A payload that, like a signal handler, sends another record
+        partway through its own send."""
+        interrupted = False
+
+        def __len__(self):
+            if not self.interrupted:
+                self.interrupted = True
+                channel.defer(lambda: channel.send(T.PROFILE, b'handler'))
+            return bytes.__len__(self)
+
+    assert channel.send(T.TRACE, Interrupting(b'interrupted'))
+    channel.close()
+
+    records = list(T.read_records(io.BytesIO(read_all(r))))
+    assert records == [(T.TRACE, b'interrupted'),
+                       (T.PROFILE, b'handler')]
+
+
+def test_report(pipe):
+    r, w = pipe
+    channel = T.Channel(w)
+    T.report(channel)
+    channel.close()
+
+    (stats_kind, stats), (rusage_kind, rusage) = T.read_records(
+        io.BytesIO(read_all(r)))
+    assert stats_kind == T.STATS
+    assert 'dirfds_held' in json.loads(stats.decode('utf-8'))
+    assert rusage_kind == T.RUSAGE
+    assert 'ru_maxrss' in json.loads(rusage.decode('utf-8'))
@@ -0,0 +1,146 @@
+import io
+import json
+import os
+
+import pytest
+from pepperbox import support as S
+from pepperbox import trace as T
+from pepperbox.restrict import limit_resources, restrict
+
+
+@pytest.fixture
+def events():
+    events = []
+    T.TRACER.enable(events.append)
+    yield events
+    T.TRACER.disable()
+
+
+def test_disabled_tracer_returns_null_span():
+    tracer = T.Tracer()
+    assert tracer.span('find', 'module') is T._NULL_SPAN
+    with tracer.span('find', 'module') as span:
+        span.note(found=True)
+        tracer.syscall('openat')
+        tracer.read(10)
+
+
+def test_spans_nest_and_attribute_to_innermost(events):
+    with T.TRACER.span('exec', 'outer', extra=1) as span:
+        T.TRACER.syscall('fstatat')
+        with T.TRACER.span('read', 'inner'):
+            T.TRACER.syscall('openat', 2)
+            T.TRACER.read(5)
+        span.note(found=True)
+
+    inner, outer = events
+    assert inner['phase'] == 'read'
+    assert inner['module'] == 'inner'
+    assert inner['depth'] == 1
+    assert inner['syscalls'] == {'openat': 2}
+    assert inner['bytes_read'] == 5
+
+    assert outer['depth'] == 0
+    assert outer['syscalls'] == {'fstatat': 1}
+    assert outer['bytes_read'] == 0
+    assert outer['extra'] == 1
+    assert outer['found']
+    assert outer['duration'] >= inner['duration']
+
+
+def test_span_records_errors(events):
+    with pytest.raises(KeyError):
+        with T.TRACER.span('exec', 'module'):
+            raise KeyError
+    [event] = events
+    assert event['error'] == 'KeyError'
+
+
+def test_DirectoryFD_syscalls(events, tmpdir):
+    tmpdir.join('file').write('contents')
+    dirobj = S.DirectoryFD(str(tmpdir))
+    with T.TRACER.span('find', 'module'):
+        assert dirobj.isfile('file')
+        assert not dirobj.exists('missing')
+        dirobj.stat('file')
+        dirobj.open('file').close()
+
+    [event] = events
+    # one openat to list the directory, one to open the file
+    assert event['syscalls'] == {'getdirentries': 1,
+                                 'fstatat': 1,
+                                 'openat': 2}
+
+
+def test_sink_from_environment(tmpdir):
+    assert T.sink_from_environment({}) is None
+
+    path = tmpdir.join('trace.jsonl')
+    sink = T.sink_from_environment({'PEPPERBOX_TRACE': str(path)})
+    sink({'phase': 'find'})
+    sink({'phase': 'exec'})
+    sink.fileobj.close()
+    assert [json.loads(line) for line in path.readlines()] == [
+        {'phase': 'find'}, {'phase': 'exec'}]
+
+    with pytest.raises(ValueError):
+        T.sink_from_environment({'PEPPERBOX_TRACE': str(path)},
+                                regular_files=False)
+    # a mistyped path isn't created
+    missing = tmpdir.join('trace.jsnol')
+    with pytest.raises(ValueError):
+        T.sink_from_environment({'PEPPERBOX_TRACE': str(missing)},
+                                regular_files=False)
+    assert not missing.check()
+
+    r, w = os.pipe()
+    sink = T.sink_from_environment({'PEPPERBOX_TRACE': 'fd:{}'.format(w)},
+                                   regular_files=False)
+    sink({'phase': 'find'})
+    sink.fileobj.close()
+    with io.open(r) as f:
+        assert json.loads(f.readline()) == {'phase': 'find'}
+
+
+def _exit_status(child):
+    pid = os.fork()
+    if not pid:
+        try:
+            child()
+        finally:
+            os._exit(0)
+    _, status = os.waitpid(pid, 0)
+    return status
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='requires fork')
+def test_restrict_rejects_regular_trace_file(tmpdir, monkeypatch):
+    monkeypatch.setenv('PEPPERBOX_TRACE', str(tmpdir.join('trace.jsonl')))
+
+    def child():
+        try:
+            restrict()
+        except ValueError:
+            os._exit(3)
+
+    status = _exit_status(child)
+    assert os.WIFEXITED(status) and os.WEXITSTATUS(status) == 3
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='requires fork')
+def test_trace_pipe_within_resource_limits():
+    r, w = os.pipe()
+
+    def child():
+        os.close(r)
+        sink = T.sink_from_environment({'PEPPERBOX_TRACE': 'fd:{}'.format(w)},
+                                       regular_files=False)
+        limit_resources()
+        sink({'phase': 'find'})
+
+    status = _exit_status(child)
+    os.close(w)
+    with io.open(r) as f:
+        lines = f.readlines()
+    assert os.WIFEXITED(status)
+    assert [json.loads(line) for line in lines] == [{'phase': 'find'}]
@@ -0,0 +1,87 @@
+import gc
+import os
+import resource
+import sys
+
+import pytest
+from pepperbox import zygote as Z
+from pepperbox.restrict import limit_resources
+
+
+pytestmark = pytest.mark.skipif(not hasattr(os, 'fork'),
+                                reason='requires fork')
+
+MODULES = 2000
+
+
+class UnsandboxedZygote(Z.Zygote):
+    """A Zygote whose children are resource limited but not put into
+    capability mode.  Extension modules can't be loaded without
+    pepperbox's compiled helpers, so limit_resources relies on
+    resource having been imported above."""
+
+    def enter(self):
+        limit_resources()
+
+
+@pytest.fixture
+def zygote(tmpdir, monkeypatch):
+    # enough modules that listing their directory takes several reads
+    for i in range(MODULES):
+        tmpdir.join('zygote_module_{}.py'.format(i)).write(
+            'VALUE = {}\n'.format(i))
+    monkeypatch.syspath_prepend(str(tmpdir))
+    monkeypatch.setattr(Z, 'default_rights', lambda: ())
+    monkeypatch.setattr(sys, 'meta_path', list(sys.meta_path))
+    monkeypatch.setattr(sys, 'path_hooks', list(sys.path_hooks))
+    yield UnsandboxedZygote(preimports=())
+    if hasattr(gc, 'unfreeze'):
+        gc.unfreeze()
+    for name in list(sys.modules):
+        if name.startswith('zygote_module_'):
+            del sys.modules[name]
+
+
+def wait(pid):
+    _, status = os.waitpid(pid, 0)
+    assert os.WIFEXITED(status)
+    return os.WEXITSTATUS(status)
+
+
+def succeed():
+    pass
+
+
+def fail():
+    raise ValueError('failed')
+
+
+def check_limited():
+    assert resource.getrlimit(resource.RLIMIT_FSIZE) == (0, 0)
+
+
+def test_freezes_collected_objects(zygote):
+    if not hasattr(gc, 'freeze'):
+        pytest.skip('requires gc.freeze')
+    assert gc.get_freeze_count()
+
+
+def test_spawn(zygote):
+    assert wait(zygote.spawn(succeed)) == 0
+    assert wait(zygote.spawn(fail)) == 1
+    assert wait(zygote.spawn(check_limited)) == 0
+
+
+def import_modules(start, step):
+    for i in range(start, MODULES, step):
+        module = __import__('zygote_module_{}'.format(i))
+        assert module.VALUE == i
+
+
+def test_concurrent_children_import(zygote):
+    # the children share the zygote's directory descriptors, and so
+    # their offsets; each must still see the whole listing
+    children = 8
+    pids = [zygote.spawn(import_modules, i, children)
+            for i in range(children)]
+    assert [wait(pid) for pid in pids] == [0] * children
@@ -0,0 +1,181 @@
+import collections
+import errno
+import json
+import os
+import stat
+import sys
+import threading
+import time
+
+
+_clock = getattr(time, 'perf_counter', time.time)
+
+
+class _NullSpan(object):
+
+    def note(self, **details):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span(object):
+
+    def __init__(self, tracer, phase, module, details):
+        self.tracer = tracer
+        self.phase = phase
+        self.module = module
+        self.details = details
+        self.bytes_read = 0
+        self.syscalls = collections.Counter()
+
+    def note(self, **details):
+        """Add details to the event this span emits."""
+        self.details.update(details)
+
+    def __enter__(self):
+        stack = self.tracer._stack()
+        self.depth = len(stack)
+        stack.append(self)
+        self.start = time.time()
+        self._started = _clock()
+        return self
+
+    def __exit__(self, *exc_info):
+        duration = _clock() - self._started
+        self.tracer._stack().pop()
+        event = dict(self.details,
+                     phase=self.phase,
+                     module=self.module,
+                     start=self.start,
+                     duration=duration,
+                     depth=self.depth,
+                     bytes_read=self.bytes_read,
+                     syscalls=dict(self.syscalls))
+        if exc_info[0] is not None:
+            event['error'] = exc_info[0].__name__
+        self.tracer.sink(event)
+
+
+class Tracer(object):
+    """Times the phases of each import and attributes the system
+    calls and bytes read during them to the innermost phase.
+
+    Each phase emits an event dict with its phase, module, start,
+    duration (which includes any nested phases), depth, bytes_read
+    and syscalls, a dict mapping system call names to counts.  The
+    phases are find, code (getting a module's code object, which
+    includes read and compile), read, compile and exec.  Imports
+    started while a module executes nest inside its exec phase.
+
+    Tracing is off until enable is called; until then span returns a
+    shared no-op span.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.sink = None
+        self._local = threading.local()
+
+    def enable(self, sink):
+        """Start tracing.
+
+        :param sink: a callable that's passed each event dict.
+        """
+        self.sink = sink
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+        self.sink = None
+
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def span(self, phase, module, **details):
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, phase, module, details)
+
+    def syscall(self, name, count=1):
+        if self.enabled:
+            stack = self._stack()
+            if stack:
+                stack[-1].syscalls[name] += count
+
+    def read(self, nbytes):
+        if self.enabled:
+            stack = self._stack()
+            if stack:
+                stack[-1].bytes_read += nbytes
+
+
+TRACER = Tracer()
+
+
+class JSONLinesSink(object):
+    """Writes each event to fileobj as a line of JSON."""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+
+    def __call__(self, event):
+        self.fileobj.write(json.dumps(event, sort_keys=True) + '\n')
+        self.fileobj.flush()
+
+
+def sink_from_environment(environ=os.environ, regular_files=True):
+    """Return a sink for the file named by PEPPERBOX_TRACE, opened
+    now so it outlives entry into the sandbox, or None if it isn't
+    set.  A value of - means standard error, and fd:N the inherited
+    file descriptor N.
+
+    :param regular_files: if false, raise ValueError rather than
+    return a sink that writes to a regular file.  restrict() sets
+    RLIMIT_FSIZE to 0, so the first event written to one would kill
+    the sandboxed process with SIGXFSZ; a pipe or socket is needed
+    there.
+    """
+    path = environ.get('PEPPERBOX_TRACE')
+    if not path:
+        return None
+    if path == '-':
+        fileobj = sys.stderr
+    elif path.startswith('fd:'):
+        fileobj = os.fdopen(int(path[len('fd:'):]), 'w')
+    else:
+        # checked before opening, which would create a missing file
+        if not regular_files and _regular_or_missing(path):
+            raise _regular_file_error(path)
+        return JSONLinesSink(open(path, 'a'))
+    if not regular_files and stat.S_ISREG(os.fstat(fileobj.fileno()).st_mode):
+        if fileobj is not sys.stderr:
+            fileobj.close()
+        raise _regular_file_error(path)
+    return JSONLinesSink(fileobj)
+
+
+def _regular_or_missing(path):
+    try:
+        return stat.S_ISREG(os.stat(path).st_mode)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+        # opening it would create a regular file
+        return True
+
+
+def _regular_file_error(path):
+    return ValueError('PEPPERBOX_TRACE={} is a regular file, which '
+                      'RLIMIT_FSIZE forbids writing to; use a pipe or '
+                      'socket'.format(path))
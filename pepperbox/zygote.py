@@ -0,0 +1,63 @@
+import gc
+import os
+import sys
+import traceback
+
+from .restrict import default_rights, limit_resources
+
+
+class Zygote(object):
+    """Does the expensive part of restrict() once -- importing
+    preimports and installing pepperbox's finders -- and then forks
+    children that need only apply restrict()'s resource limits and
+    enter capability mode.
+
+    Create it in a process dedicated to spawning sandboxed workers:
+    it replaces that process's sys.meta_path.  The arguments are
+    those of pepperbox.loader.install, less rights.
+    """
+
+    def __init__(self, preimports=('random',), **install_kwargs):
+        import pepperbox.loader
+        pepperbox.loader.install(rights=default_rights(),
+                                 preimports=preimports,
+                                 **install_kwargs)
+        # everything allocated so far is shared with the children.  a
+        # collection in a child writes to every object it visits,
+        # copying the pages they live on, so move them out of the
+        # collector's reach.
+        gc.collect()
+        if hasattr(gc, 'freeze'):
+            gc.freeze()
+
+    def enter(self):
+        """Sandbox the calling process, which should be a child of
+        spawn."""
+        import spyce
+        limit_resources()
+        spyce.enterCapabilityMode()
+
+    def spawn(self, target, *args, **kwargs):
+        """Fork a child that enters the sandbox and then calls
+        target(*args, **kwargs).  Returns the child's pid.
+
+        The child exits with status 0 if target returns and 1 if it
+        raises.
+        """
+        pid = os.fork()
+        if pid:
+            return pid
+
+        status = 1
+        try:
+            self.enter()
+            target(*args, **kwargs)
+            status = 0
+        except BaseException:
+            traceback.print_exc()
+        finally:
+            try:
+                sys.stdout.flush()
+                sys.stderr.flush()
+            finally:
+                os._exit(status)
@@ -2,7 +2,6 @@ if __name__ == '__main__':
     import os
     import sys
     from setuptools import setup, find_packages
-    from pepperbox._ffi import ffi
 
     kwargs = {}
     if os.environ.get('INSTALL_CUSTOMIZE'):
@@ -17,6 +16,6 @@ if __name__ == '__main__':
           install_requires=requirements,
           include_package_data=True,
           packages=find_packages(),
-          ext_package='pepperbox',
-          ext_modules=[ffi.verifier.get_extension()],
+          setup_requires=['cffi>=1.0.0'],
+          cffi_modules=['pepperbox/_ffi_build.py:ffibuilder'],
           **kwargs)